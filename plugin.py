@@ -42,92 +42,248 @@
 
 import DomoticzEx as Domoticz
 import json
+import hashlib
 import time
 import sys
 from collections import deque
-from collections import OrderedDict
-if (sys.version_info.major == 3) and (sys.version_info.minor >= 10):
-    from collections.abc import MutableMapping
-    from collections.abc import Mapping
-else:
-    from collections import MutableMapping
-    from collections import Mapping
 import traceback
 import re
 import shlex
+import heapq
+import random
+
+# field of an ebusd message linked to a domoticz unit, slots keep memory low when thousands of fields are discovered
+#   oDevice: object: unit object corresponding in Devices dict
+#   sCircuit: string: circuit name, for instance "f47"
+#   sMessage: string: register, for instance "OutsideTemp"
+#   iFieldIndex: integer: field index (0 based)
+#   iFieldsCount: integer: total number of fields
+#   dOptions: dictionnary: keyed by ebusd value, contains selector switch level integer value, empty if not selector switch
+#   bForceRefresh: boolean: to refresh device at creation
+#   bAlwaysRefresh: boolean: to refresh at a regular basis
+#   dReverseOptions: dictionnary: keyed by selector switch level integer valu, contains selector switch ebusd string value, empty if not selector switch
+#   dDomoticzOptions: dictionnary: options send during domoticz device type selector switch creation and update
+#   sFieldType: string: cf. getFieldType() return value
+#   fnToDomoticz: function: converter of ebusd field value to domoticz values, cf. compileEbusdToDomoticz()
+#   fnToEbusd: function: converter of domoticz command to ebusd field value, cf. compileDomoticzToEbusd()
+#   sFieldsValues: string: fields values read after "readwhole" operation, None until first read
+#   iFieldsValuesTimestamp: integer: time when fields values have been updated
+#   iReadTimestamp: integer: time when last read command has been sent
+#   iListenTimestamp: integer: time when fields values have been received in listen mode, without being requested by a read command
+#   sDeviceID: string: DeviceID of the device in Devices dict
+#   iUnit: integer: unit number in device
+#   lRegisterKeys: list of strings: register keys used to find register options
+#   bCached: boolean: True if unit has been restored from schema cache and not found again in JSON data yet
+#   fDeadband: float: changes of numeric value smaller than this don't update the domoticz device
+#   iUpdateTimestamp: integer: time when the domoticz device has been updated with a new value
+#   iDebounce: integer: time in s during which commands are gathered before writing, 0 to write at once
+class UnitRecord:
+    __slots__ = ("oDevice", "sCircuit", "sMessage", "iFieldIndex", "iFieldsCount", "dOptions", "bForceRefresh", "bAlwaysRefresh", "dReverseOptions", "dDomoticzOptions", "sFieldType", "fnToDomoticz", "fnToEbusd", "sFieldsValues", "iFieldsValuesTimestamp", "iReadTimestamp", "iListenTimestamp", "sDeviceID", "iUnit", "lRegisterKeys", "bCached", "fDeadband", "iUpdateTimestamp", "iDebounce")
+
+    def __init__(self, sCircuit, sMessage, iFieldIndex, iFieldsCount, dOptions, dReverseOptions, dDomoticzOptions, sFieldType, bForceRefresh, bAlwaysRefresh, lRegisterKeys):
+        # circuit and message names are repeated for each field, and used as dictionnary keys
+        self.sCircuit = sys.intern(sCircuit)
+        self.sMessage = sys.intern(sMessage)
+        self.iFieldIndex = iFieldIndex
+        self.iFieldsCount = iFieldsCount
+        self.dOptions = dOptions
+        self.dReverseOptions = dReverseOptions
+        self.dDomoticzOptions = dDomoticzOptions
+        self.sFieldType = sFieldType
+        self.bForceRefresh = bForceRefresh
+        self.bAlwaysRefresh = bAlwaysRefresh
+        self.lRegisterKeys = lRegisterKeys
+        self.oDevice = None
+        self.fnToDomoticz = None
+        self.fnToEbusd = None
+        self.sFieldsValues = None
+        self.iFieldsValuesTimestamp = 0
+        self.iReadTimestamp = 0
+        self.iListenTimestamp = 0
+        self.sDeviceID = ""
+        self.iUnit = 0
+        self.bCached = False
+        self.fDeadband = 0.0
+        self.iUpdateTimestamp = 0
+        self.iDebounce = 0
+
+# command queue with priority classes, a command is popped only when all classes with higher priority are empty
+# only one read per message is kept pending (reads before write excepted, as they must stay in front of their write), and successive writes to the same field are collapsed into the latest value
+class PriorityFifo:
+    # priority classes, from highest to lowest priority
+    PRIORITY_WRITE = 0
+    PRIORITY_READAFTERWRITE = 1
+    PRIORITY_DISCOVERY = 2
+    PRIORITY_REFRESH = 3
+    # list of strings: priority classes names, for logs
+    lPriorityNames = ["write", "read after write", "discovery", "refresh"]
+    # list of dequeues of dictionnaries, one per priority class
+    lQueues = None
+    # integer: number of pending commands, cancelled commands excluded
+    iLength = 0
+    # dictionnary of pending commands, keyed by tuples ("read", circuit, message), ("readbeforewrite", circuit, message) or ("write", circuit, message, fieldindex)
+    dPending = None
+    # list of integers: number of commands queued per priority class
+    lQueuedCounters = None
+    # list of integers: number of commands merged with a pending command per priority class
+    lMergedCounters = None
+    # list of integers: number of commands popped per priority class
+    lPoppedCounters = None
 
-# https://github.com/requests/requests/blob/master/requests/structures.py
-class CaseInsensitiveDict(MutableMapping):
-    """A case-insensitive ``dict``-like object.
-    Implements all methods and operations of
-    ``MutableMapping`` as well as dict's ``copy``. Also
-    provides ``lower_items``.
-    All keys are expected to be strings. The structure remembers the
-    case of the last key to be set, and ``iter(instance)``,
-    ``keys()``, ``items()``, ``iterkeys()``, and ``iteritems()``
-    will contain case-sensitive keys. However, querying and contains
-    testing is case insensitive::
-        cid = CaseInsensitiveDict()
-        cid['Accept'] = 'application/json'
-        cid['aCCEPT'] == 'application/json'  # True
-        list(cid) == ['Accept']  # True
-    For example, ``headers['content-encoding']`` will return the
-    value of a ``'Content-Encoding'`` response header, regardless
-    of how the header name was originally stored.
-    If the constructor, ``.update``, or equality comparison
-    operations are given keys that have equal ``.casefold()``s, the
-    behavior is undefined.
-    """
-
-    def __init__(self, data=None, **kwargs):
-        self._store = OrderedDict()
-        if data is None:
-            data = {}
-        self.update(data, **kwargs)
-        
-    # lower and remove substring between []
-    def __lowerAndFilter(self, key):
-        return re.sub(r'\[.+?\]', '', key).casefold()
-
-    def __setitem__(self, key, value):
-        # Use the lowercased key for lookups, but store the actual
-        # key alongside the value.
-        self._store[self.__lowerAndFilter(key)] = (key, value)
-
-    def __getitem__(self, key):
-        return self._store[self.__lowerAndFilter(key)][1]
-
-    def __delitem__(self, key):
-        del self._store[self.__lowerAndFilter(key)]
-
-    def __iter__(self):
-        return (casedkey for casedkey, mappedvalue in self._store.values())
+    def __init__(self):
+        self.lQueues = [deque() for sName in self.lPriorityNames]
+        self.iLength = 0
+        self.dPending = {}
+        self.lQueuedCounters = [0] * len(self.lPriorityNames)
+        self.lMergedCounters = [0] * len(self.lPriorityNames)
+        self.lPoppedCounters = [0] * len(self.lPriorityNames)
 
     def __len__(self):
-        return len(self._store)
-
-    def lower_items(self):
-        """Like iteritems(), but with all lowercase keys."""
-        return (
-            (lowerkey, keyval[1])
-            for (lowerkey, keyval)
-            in self._store.items()
-        )
-
-    def __eq__(self, other):
-        if isinstance(other, Mapping):
-            other = CaseInsensitiveDict(other)
-        else:
-            return NotImplemented
-        # Compare insensitively
-        return dict(self.lower_items()) == dict(other.lower_items())
-
-    # Copy is required
-    def copy(self):
-        return CaseInsensitiveDict(self._store.values())
-
-    def __repr__(self):
-        return str(dict(self.items()))
+        return self.iLength
+
+    # Give the key used to find a pending command similar to dCommand, None if the command cannot be merged
+    #   dCommand: dictionnary: command, see TelnetChannel.dqFifo
+    #   iPriority: integer: priority class
+    def getKey(self, dCommand, iPriority):
+        oRecord = dCommand["unit"]
+        if type(oRecord) is not UnitRecord:
+            return None
+        if (dCommand["operation"] == "write") and ("fields" in dCommand):
+            return ("writefields", oRecord.sCircuit, oRecord.sMessage)
+        elif dCommand["operation"] == "write":
+            return ("write", oRecord.sCircuit, oRecord.sMessage, oRecord.iFieldIndex)
+        elif dCommand["operation"] == "read":
+            if iPriority == self.PRIORITY_WRITE:
+                return ("readbeforewrite", oRecord.sCircuit, oRecord.sMessage)
+            else:
+                return ("read", oRecord.sCircuit, oRecord.sMessage)
+        return None
+
+    # Add a command to the queue, or merge it with a similar pending command, return False if merged
+    #   dCommand: dictionnary: command, see TelnetChannel.dqFifo
+    #   iPriority: integer: priority class
+    def append(self, dCommand, iPriority):
+        tKey = self.getKey(dCommand, iPriority)
+        dPendingCommand = self.dPending.get(tKey) if tKey else None
+        if dPendingCommand:
+            if (dCommand["operation"] == "write") and ("fields" in dCommand):
+                # keep only latest value of each field
+                dPendingCommand["fields"].update(dCommand["fields"])
+                self.lMergedCounters[iPriority] += 1
+                return False
+            elif dCommand["operation"] == "write":
+                # keep only latest value
+                dPendingCommand["value"] = dCommand["value"]
+                self.lMergedCounters[iPriority] += 1
+                return False
+            elif dPendingCommand["priority"] <= iPriority:
+                # pending read keeps asking for a recent value
+                if dCommand.get("fresh"):
+                    dPendingCommand["fresh"] = True
+                self.lMergedCounters[iPriority] += 1
+                return False
+            else:
+                # move pending read to the higher priority class
+                if dPendingCommand.get("fresh"):
+                    dCommand["fresh"] = True
+                dPendingCommand["cancelled"] = True
+                self.iLength -= 1
+                self.lMergedCounters[dPendingCommand["priority"]] += 1
+        dCommand["priority"] = iPriority
+        dCommand["cancelled"] = False
+        self.lQueues[iPriority].append(dCommand)
+        self.iLength += 1
+        self.lQueuedCounters[iPriority] += 1
+        if tKey:
+            self.dPending[tKey] = dCommand
+        return True
+
+    # Give the next command without removing it from the queue, None if empty
+    def peek(self):
+        for dqQueue in self.lQueues:
+            # forget cancelled commands
+            while (len(dqQueue) > 0) and dqQueue[0]["cancelled"]:
+                dqQueue.popleft()
+            if len(dqQueue) > 0:
+                return dqQueue[0]
+        return None
+
+    # Remove and give the next command, None if empty
+    def popleft(self):
+        dCommand = self.peek()
+        if dCommand:
+            iPriority = dCommand["priority"]
+            self.lQueues[iPriority].popleft()
+            self.iLength -= 1
+            self.lPoppedCounters[iPriority] += 1
+            tKey = self.getKey(dCommand, iPriority)
+            if tKey and (self.dPending.get(tKey) is dCommand):
+                del self.dPending[tKey]
+        return dCommand
+
+    # Put back a command sent without answer at the head of its priority class, return False if dropped because a similar command is pending
+    #   dCommand: dictionnary: command, see TelnetChannel.dqFifo
+    def requeue(self, dCommand):
+        iPriority = dCommand["priority"]
+        tKey = self.getKey(dCommand, iPriority)
+        if tKey and (tKey in self.dPending):
+            self.lMergedCounters[iPriority] += 1
+            return False
+        dCommand["cancelled"] = False
+        self.lQueues[iPriority].appendleft(dCommand)
+        self.iLength += 1
+        if tKey:
+            self.dPending[tKey] = dCommand
+        return True
+
+    # Give counters as a string, for logs
+    def getCounters(self):
+        return ", ".join(sName + ": " + str(sum(1 for dCommand in self.lQueues[iPriority] if not dCommand["cancelled"])) + " pending, " + str(self.lQueuedCounters[iPriority]) + " queued, " + str(self.lMergedCounters[iPriority]) + " merged, " + str(self.lPoppedCounters[iPriority]) + " sent" for iPriority, sName in enumerate(self.lPriorityNames))
+
+# telnet connection to ebusd with its own command queue, a channel handles a subset of circuits
+class TelnetChannel:
+    # integer: channel number, 1 based
+    iIndex = 0
+    # telnet connection
+    telnetConn = None
+    # bytearray buffer for telnet data, holds the incomplete last answer
+    baBuffer = None
+    # integer: position in baBuffer from which end of answer is searched, data before has already been scanned
+    iScanPos = 0
+    # PriorityFifo of dictionnaries
+    #   "operation": string: can be "read", "readwhole", "write", "authenticate"
+    #   "unit": UnitRecord contained in dUnitsByDeviceID
+    #   "value": string: value to write in ebusd format, used only for "write" operation
+    #   "fields": dictionnary of strings keyed by field index: values to write in ebusd format for many fields of a message at once, replaces "value" for "write" operation
+    #   "validated": boolean: True if other fields values have been found recent enough when write has been queued, no read before write, used only for "write" operation of a message with more than one field
+    #   "fresh": boolean: True if value must not be older than refresh interval, used only for "read" operation after a bulk read without recent value
+    #   "priority": integer: priority class, see PriorityFifo
+    #   "cancelled": boolean: True if command has been merged into another one and must be ignored
+    #   "sendtimestamp": integer: time when command has been sent, set when sent
+    #   "retries": integer: number of times command has been sent without answer, set after a timeout
+    dqFifo = None
+    # string that contains the connection step: "idle", then "connecting", then "connected", then "data sending" when no more command can be sent before an answer
+    sConnectionStep = None
+    # integer: time when connection step has been updated
+    iConnectionTimestamp = None
+    # dequeue of dictionnaries: commands from dqFifo sent and waiting for an answer, in sending order
+    dqInFlight = None
+    # integer: delay in s before next connection attempt after a failure, doubled at each failure, reset when an answer is received
+    iReconnectDelay = 0
+    # integer: time before which connection must not be attempted again
+    iReconnectTime = 0
+
+    def __init__(self, iIndex):
+        self.iIndex = iIndex
+        self.telnetConn = None
+        self.baBuffer = bytearray()
+        self.iScanPos = 0
+        self.dqFifo = PriorityFifo()
+        self.sConnectionStep = "idle"
+        self.iConnectionTimestamp = 0
+        self.dqInFlight = deque()
+        self.iReconnectDelay = 0
+        self.iReconnectTime = 0
 
 class BasePlugin:
     # string address port from parameters
@@ -146,16 +302,75 @@ class BasePlugin:
     bParamAutoAdd = False
     # boolean debug from parameters
     iParamDebug = 0
+    # list of strings: registers from parameters, without plugin options
+    lParamRegisters = None
+    # dictionnary of plugin options from registers parameter, keyed by option name (@option or @option=value), contains value string
+    dParamOptions = None
+    # list of tuples (compiled regex, dictionnary of options keyed by option name) for registers given with options (register@option=value)
+    lParamRegistersOptions = None
+    # boolean adaptive refresh for all registers from registers parameter options
+    bParamAdaptive = False
+    # integer: max age in s of values read from ebusd cache for all registers, from registers parameter options, None to let ebusd decide
+    iParamMaxAge = None
+    # integer: time in s during which commands for a unit are gathered before writing for all registers, from registers parameter options, 0 to write at once
+    iParamDebounce = 0
+    # integer: heartbeat interval in s when no write is pending
+    iHeartbeatInterval = 30
+    # dictionnary of dictionnaries keyed by tuples (circuit, message), writes waiting for the end of their debounce time
+    #   "unit": UnitRecord: first unit written, used to queue the write
+    #   "fields": dictionnary of strings keyed by field index: latest values to write in ebusd format
+    #   "due": integer: time when the write is queued
+    dPendingWrites = None
+    # dictionnary of floats keyed by field type, changes of numeric values smaller than the deadband don't update domoticz devices, from registers parameter options
+    dParamDeadbands = None
+    # dictionnary of floats keyed by field type, deadbands used when deadband option is given without value
+    dDefaultDeadbands = {"temperature": 0.2, "pressure": 0.05}
+    # integer: min interval in s between two updates of a domoticz device with a numeric value, from registers parameter options
+    iParamMinUpdate = 0
+    # boolean listen mode from registers parameter options
+    bParamListen = False
+    # boolean bulk refresh through JSON HTTP port from registers parameter options
+    bParamBulk = False
+    # boolean discovery of definitions circuit by circuit, only for circuits that can match registers, from registers parameter options
+    bParamSelective = False
+    # integer: max number of telnet commands sent without waiting for an answer, from registers parameter options
+    iParamPipeline = 1
+    # integer: number of parallel telnet connections, from registers parameter options
+    iParamConnections = 1
     # boolean to check that we are started, to prevent error messages when disabling or restarting the plugin
     bIsStarted = None
-    # boolean to ask restart of the plugin
-    bShallRestart = None
-    # telnet connection
-    telnetConn = None
-    # string buffer for telnet data
-    sBuffer = None
+    # list of TelnetChannel objects, telnet connections pool
+    lChannels = None
+    # dictionnary of TelnetChannel objects keyed by circuit, to always send commands for a circuit through the same connection
+    dCircuitChannels = None
+    # dictionnary of dictionnaries keyed by circuit, only for circuits whose last reads failed because the device didn't answer
+    #   "errors": dictionnary of integers keyed by message: number of read errors of each message since the circuit last answered
+    #   "open": boolean: True if reads of the circuit are skipped, except probes
+    #   "delay": integer: interval in s between probes, doubled after each failed probe
+    #   "probe": integer: time when next probe read is allowed
+    dCircuitBreakers = None
+    # dictionnary of sets keyed by circuit, messages whose reads have already been answered, only they can open a circuit breaker and be used as probes
+    dAnsweredMessages = None
     # json http connection
     jsonConn = None
+    # dequeue of dictionnaries, requests for JSON HTTP connection
+    #   "request": string: can be "find", "circuits" or "data"
+    #   "url": string: requested URL
+    #   "circuit": string: circuit name, used only for "find" request of a single circuit
+    #   "count": integer: messages count of the circuit, used only for "find" request of a single circuit
+    #   "global": dictionnary: global ebusd data from circuits list, used only for "find" request of a single circuit
+    #   "units": list of UnitRecord contained in dUnitsByDeviceID, first unit of each message to refresh, used only for "data" request
+    #   "timestamp": integer: time when request has been queued, used only for "data" request
+    #   "sendtimestamp": integer: time when request has been sent
+    dqJsonFifo = None
+    # dictionnary: request from dqJsonFifo waiting for an answer, None if no request in progress
+    dJsonCurrentRequest = None
+    # telnet connection in listen mode
+    listenConn = None
+    # bytearray buffer for listen telnet data, holds the incomplete last line
+    baListenBuffer = None
+    # integer: position in baListenBuffer from which end of line is searched, data before has already been scanned
+    iListenScanPos = 0
     # boolean that indicates that some registers weren't found yet
     bStillToLook = None
     # integer that count number of json objects
@@ -172,38 +387,87 @@ class BasePlugin:
     sRegExExclude = None
     # regex filled
     bRegExFilled = False
+    # list of compiled regex matching circuit names that can match a search pattern, None if any circuit can match
+    lRegExSearchCircuits = None
+    # list of compiled regex matching circuit names whose registers are all excluded
+    lRegExExcludeCircuits = None
+    # dictionnary of integers keyed by circuit, messages count of each circuit when its definitions have been parsed
+    dCircuitCounts = None
     # dictionnary of messages extracted from json, structured as keys wih circuit:message and circuit:message:fieldindex and pointing to json iFieldElement
     dMessages = None
-    # dictionnary of dictonnaries, keyed by deviceid string (circuit:register:fieldindex, for instance "f47:OutsideTemp:0")
-    #   "device": object: object corresponding in Devices dict
-    #   "circuit": string: circuit name, for instance "f47"
-    #   "message": string: register, for instance "OutsideTemp"
-    #   "fieldindex": integer: field index (0 based)
-    #   "fieldscount": integer: total number of fields
-    #   "options": dictionnary: keyed by ebusd value, contains selector switch level integer value, empty if not selector switch
-    #   "forcerefresh": boolean: to refresh device at creation
-    #   "alwaysrefresh": boolean: to refresh at a regular basis
-    #   "reverseoptions": dictionnary: keyed by selector switch level integer valu, contains selector switch ebusd string value, empty if not selector switch
-    #   "domoticzoptions": dictionnary: options send during domoticz device type selector switch creation and update
-    #   "fieldtype": string: cf. getFieldType() return value
-    #   "fieldsvalues": string: fields values read after "readwhole" operation
-    #   "fieldsvaluestimestamp": integer: time when fields values have been updated
+    # dictionnary of lists of strings keyed by tuples (circuit, message), keys of dMessages for each message
+    dMessageKeys = None
+    # dictionnary of dictionnaries keyed by circuit then message, signature of each message from last parse, to parse only what changed
+    dSchemaSignatures = None
+    # set of strings: registers that couldn't be added and must be looked for again during next parse
+    setRetryRegisters = None
+    # dictionnary of UnitRecord, keyed by deviceid string (circuit:register:fieldindex, for instance "f47:OutsideTemp:0"), or of error strings for registers that can't be added
     dUnitsByDeviceID = None
     # same dictionnary, but keyed by 3 dimensions: dUnits3D[circuit][register][fieldindex]
     dUnits3D = None
-    # dequeue of dictionnaries
-    #   "operation": string: can be "read", "readwhole", "write", "authenticate"
-    #   "unit": dict contained in dUnitsByDeviceID
-    #   "value": string: value to write in ebusd format, used only for "write" operation
-    dqFifo = None
-    # string that contains the connection step: "idle", then "connecting", then "connected", then "data sending"
-    sConnectionStep = None
-    # integer: time when connection step has been updated
-    iConnectionTimestamp = None
-    # string: keep track of current operation, see dfFifo
-    sCurrentCommand = None
+    # dictionnary of dictionnaries keyed by frozenset of their items, option tables shared between units
+    dSharedTables = None
+    # dictionnary of tuples (DeviceID, unit number) keyed by casefolded DeviceID, first unit of each device in Devices dict
+    dDeviceIDIndex = None
+    # list used as min-heap of tuples (due time, circuit, message), next refresh time of each message
+    lRefreshHeap = None
+    # list used as min-heap of tuples (deadline, deviceid), time after which each unit is timed out if not refreshed
+    lTimeoutHeap = None
+    # dictionnary of floats keyed by deviceid, deadline of the valid heap entry of each unit, heap entries with another deadline are obsolete
+    dTimeoutDeadlines = None
+    # boolean: True once devices not detected during discovering have been timed out
+    bUndetectedChecked = False
+    # integer: format version of schema cache file, cache files with another version are ignored
+    iSchemaCacheVersion = 3
+    # string: path of schema cache file, empty if no cache
+    sSchemaCacheFile = ""
+    # integer: format version of values snapshot file, snapshot files with another version are ignored
+    iSnapshotVersion = 1
+    # string: path of values snapshot file, empty if no snapshot
+    sSnapshotFile = ""
+    # dictionnary of tuples (fields values, timestamp) keyed by tuples (circuit, message), values saved during last run
+    dSnapshotValues = None
+    # integer: interval in s between periodic saves of values snapshot
+    iSnapshotRate = 600
+    # integer: time of last save of values snapshot
+    iSnapshotTime = 0
+    # dictionnary: ebusd version and messages count from last parsed JSON data, saved with schema cache
+    dEbusdSignature = None
+    # dictionnary of strings keyed by tuples (circuit, message), signature of definition of messages of units, saved with schema cache, see getMessageSignature()
+    dDefinitionSignatures = None
+    # dictionnary of dictionnaries keyed by tuples (circuit, message), state of each message
+    #   "refreshrate": integer: configured refresh rate in s
+    #   "adaptive": boolean: refresh interval adapts to observed changes
+    #   "maxage": integer: max age in s of cached values, lowest of fields of the message, None to let ebusd decide
+    #   "interval": float: current refresh interval in s
+    #   "due": float: next refresh time, heap entries with another due time are obsolete
+    dMessageStates = None
+    # float: ratio between refresh rate and minimum interval in adaptive mode
+    fAdaptiveMinRatio = 0.25
+    # float: ratio between refresh rate and maximum interval in adaptive mode
+    fAdaptiveMaxRatio = 8.0
+    # float: interval multiplier in adaptive mode when value didn't change
+    fAdaptiveIncrease = 1.5
+    # float: interval multiplier in adaptive mode when value changed
+    fAdaptiveDecrease = 0.5
     # integer: timeout in s
     iTimeoutConstant = 10
+    # integer: max number of times a telnet command is sent again after a timeout or a lost connection
+    iMaxCommandRetries = 1
+    # integer: delay in s before second connection attempt after a failure, the first attempt is immediate
+    iReconnectMinDelay = 2
+    # integer: max delay in s between connection attempts
+    iReconnectMaxDelay = 300
+    # integer: max size in bytes of an incomplete telnet answer or listen line
+    iMaxReceiveSize = 1048576
+    # integer: number of read errors after which reads of a circuit are skipped, if all its already answered messages fail
+    iBreakerThreshold = 3
+    # tuple of strings: ebusd errors telling that the device didn't answer, other errors are bus wide or specific to a message
+    tNoAnswerErrors = ("read timeout", "NAK received")
+    # integer: first interval in s between probe reads of a circuit whose reads are skipped
+    iBreakerMinDelay = 60
+    # integer: max interval in s between probe reads of a circuit whose reads are skipped
+    iBreakerMaxDelay = 3600
     # integer: max heartbeat interval in s
     iMaxHeartbeatInterval = 30
     # integer: time when discovering starts
@@ -219,152 +483,607 @@ class BasePlugin:
     
     def __init__(self):
         self.bIsStarted = False
-        self.bShallRestart = False
-        self.telnetConn = None
+        self.lChannels = [TelnetChannel(iIndex + 1) for iIndex in range(self.iParamConnections)]
+        self.dCircuitChannels = {}
+        self.dCircuitBreakers = {}
+        self.dAnsweredMessages = {}
+        self.dPendingWrites = {}
         self.jsonConn = None
+        self.dqJsonFifo = deque()
+        self.dJsonCurrentRequest = None
+        self.listenConn = None
+        self.baListenBuffer = bytearray()
+        self.iListenScanPos = 0
         self.sRegExSearch = None
         self.sRegExExclude = None
         self.bRegExFilled = False
+        self.lRegExSearchCircuits = None
+        self.lRegExExcludeCircuits = []
+        self.dCircuitCounts = {}
         self.dMessages = {}
+        self.dMessageKeys = {}
+        self.dSchemaSignatures = {}
+        self.setRetryRegisters = set()
         self.dUnitsByDeviceID = {}
         self.dUnits3D = {}
-        self.sBuffer = ""
+        self.dDeviceIDIndex = {}
+        self.dSharedTables = {}
+        self.lRefreshHeap = []
+        self.dMessageStates = {}
+        self.lTimeoutHeap = []
+        self.dTimeoutDeadlines = {}
+        self.bUndetectedChecked = False
+        self.dSnapshotValues = {}
+        self.dEbusdSignature = {}
+        self.dDefinitionSignatures = {}
         self.bStillToLook = True
         self.iJsonObjects = 0
         timeNow = time.time()
         self.iRefreshTime = timeNow
         self.iRefreshFindDeviceTime = timeNow
         self.iDiscoverStartTime = timeNow
-        self.dqFifo = deque()
-        self.sConnectionStep = "idle"
-        self.iConnectionTimestamp = 0
-        self.sCurrentCommand = ""
 
     def myDebug(self, message):
         if self.iParamDebug:
             Domoticz.Log(message)
 
+    # Give the telnet channel used for a circuit, circuits are spread over channels in order of first use
+    #   sCircuit: string: circuit name
+    def getChannel(self, sCircuit):
+        oChannel = self.dCircuitChannels.get(sCircuit)
+        if oChannel is None:
+            oChannel = self.lChannels[len(self.dCircuitChannels) % len(self.lChannels)]
+            self.dCircuitChannels[sCircuit] = oChannel
+            self.myDebug("Circuit " + sCircuit + " handled by telnet connection " + str(oChannel.iIndex))
+        return oChannel
+
+    # Give the telnet channel owning a connection, None if not a telnet channel connection
+    #   Connection: Domoticz connection object
+    def getChannelByConnection(self, Connection):
+        for oChannel in self.lChannels:
+            if oChannel.telnetConn == Connection:
+                return oChannel
+        return None
+
+    # Split registers parameter into registers and plugin options, options are tokens beginning with @, like @option or @option=value
+    # options for some registers are given after the register, like register@option=value@option=value
+    #   sParameter: string: registers parameter
+    def parseRegistersParameter(self, sParameter):
+        self.lParamRegisters = []
+        self.dParamOptions = {}
+        self.lParamRegistersOptions = []
+        for sToken in shlex.split(sParameter.strip()):
+            if sToken.startswith("@"):
+                sOption, _, sValue = sToken[1:].partition("=")
+                self.dParamOptions[sOption.casefold()] = sValue
+            else:
+                lParts = sToken.split("@")
+                sRegister = lParts[0]
+                self.lParamRegisters.append(sRegister)
+                if (len(lParts) > 1) and sRegister and not sRegister.startswith("!"):
+                    dOptions = {}
+                    for sPart in lParts[1:]:
+                        sOption, _, sValue = sPart.partition("=")
+                        dOptions[sOption.casefold()] = sValue
+                    try:
+                        self.lParamRegistersOptions.append((re.compile(sRegister, re.IGNORECASE), dOptions))
+                    except re.error:
+                        Domoticz.Error("Register " + sRegister + " is not a valid regular expression, options ignored")
+
+    # Give refresh rate, adaptive mode and max age of cached values for a register, from options of first register given with options matching one of the keys
+    #   lKeys: list of strings: register keys, for instance circuit:message:fieldindex and circuit:message:fieldname
+    def getRegisterOptions(self, lKeys):
+        iRefreshRate = self.iParamRefreshRate
+        bAdaptive = self.bParamAdaptive
+        iMaxAge = self.iParamMaxAge
+        iDebounce = self.iParamDebounce
+        for oRegEx, dOptions in self.lParamRegistersOptions:
+            if any(oRegEx.search(sKey) for sKey in lKeys):
+                if "refresh" in dOptions:
+                    try:
+                        iRefreshRate = max(1, int(dOptions["refresh"]))
+                    except ValueError:
+                        Domoticz.Error("Refresh option incorrect for register " + oRegEx.pattern + ", set to its default value")
+                if "adaptive" in dOptions:
+                    bAdaptive = dOptions["adaptive"].casefold() not in ("0", "false", "no")
+                if "maxage" in dOptions:
+                    try:
+                        iMaxAge = max(0, int(dOptions["maxage"]))
+                    except ValueError:
+                        Domoticz.Error("Max age option incorrect for register " + oRegEx.pattern + ", set to its default value")
+                if "debounce" in dOptions:
+                    try:
+                        iDebounce = max(0, int(dOptions["debounce"]))
+                    except ValueError:
+                        Domoticz.Error("Debounce option incorrect for register " + oRegEx.pattern + ", set to its default value")
+                break
+        return iRefreshRate, bAdaptive, iMaxAge, iDebounce
+
+    # Connect to telnet port in listen mode, to receive messages seen on the bus without polling
+    def listen(self):
+        if self.listenConn == None:
+            self.myDebug("listen() create connection to " + self.sParamAddress + ":" + str(self.iParamTelnetPort))
+            self.listenConn = Domoticz.Connection(Name="Telnet listen", Transport="TCP/IP", Protocol="", Address=self.sParamAddress, Port=str(self.iParamTelnetPort))
+        if not (self.listenConn.Connected() or self.listenConn.Connecting()):
+            self.myDebug("Connect listen")
+            self.baListenBuffer = bytearray()
+            self.iListenScanPos = 0
+            self.listenConn.Connect()
+
     # Connect to JSON HTTP port to get list of ebusd devices
     def findDevices(self):
+        # no need to queue a new search if one is already pending
+        if (self.dJsonCurrentRequest and (self.dJsonCurrentRequest["request"] in ("find", "circuits"))) or any(dRequest["request"] in ("find", "circuits") for dRequest in self.dqJsonFifo):
+            self.myDebug("findDevices() search already pending")
+            return
+        self.myDebug("Find")
+        if self.bParamSelective:
+            # get list of circuits first, definitions are then requested only for circuits that can match
+            self.dqJsonFifo.append({"request": "circuits", "url": "/data"})
+        else:
+            # we connect with def and write to get complete list of fields and writable registers
+            self.dqJsonFifo.append({"request": "find", "url": "/data?def&write"})
+        self.handleJsonFifo()
+
+    # Ask ebusd for all values in its cache at once, through JSON HTTP port
+    #   lUnits: list of dictionnaries: first unit of each message to refresh
+    def readBulk(self, lUnits):
+        self.myDebug("readBulk() called for " + str(len(lUnits)) + " messages")
+        self.dqJsonFifo.append({"request": "data", "url": "/data", "units": lUnits, "timestamp": time.time()})
+        self.handleJsonFifo()
+
+    # Handle the connection to JSON HTTP port and the request queue, only one request at a time
+    def handleJsonFifo(self):
+        Domoticz.Debug("handleJsonFifo() called")
         if self.jsonConn == None:
-            self.myDebug("findDevices() create connection to " + self.sParamAddress + ":" + str(self.iParamJsonPort))
+            self.myDebug("handleJsonFifo() create connection to " + self.sParamAddress + ":" + str(self.iParamJsonPort))
             self.jsonConn = Domoticz.Connection(Name="JSON HTTP", Transport="TCP/IP", Protocol="HTTP", Address=self.sParamAddress, Port=str(self.iParamJsonPort))
 
+        if self.dJsonCurrentRequest:
+            # request seems lost, forget it
+            if time.time() >= (self.dJsonCurrentRequest["sendtimestamp"] + (3 * self.iTimeoutConstant)):
+                Domoticz.Error("Timeout during JSON HTTP request " + self.dJsonCurrentRequest["url"])
+                self.abortJsonRequest(self.dJsonCurrentRequest)
+                self.dJsonCurrentRequest = None
+            else:
+                return
+            
+        if len(self.dqJsonFifo) == 0:
+            return
+
         if not self.jsonConn.Connected():
-            self.myDebug("Connect")
-            self.jsonConn.Connect()
+            if not self.jsonConn.Connecting():
+                self.myDebug("Connect")
+                self.jsonConn.Connect()
         else:
-            self.myDebug("Find")
-            # we connect with def and write to get complete list of fields and writable registers
+            self.dJsonCurrentRequest = self.dqJsonFifo.popleft()
+            self.dJsonCurrentRequest["sendtimestamp"] = time.time()
+            self.myDebug("JSON HTTP request " + self.dJsonCurrentRequest["url"])
             sendData = { "Verb" : "GET",
-                        "URL"  : "/data?def&write",
+                        "URL"  : self.dJsonCurrentRequest["url"],
                         "Headers" : { "Content-Type": "text/xml; charset=utf-8", \
                                         "Connection": "keep-alive", \
                                         "Accept": "Content-Type: text/html; charset=UTF-8", \
                                         "Host": self.sParamAddress+":"+str(self.iParamJsonPort), \
                                         "User-Agent":"Domoticz/1.0" }
                        }
-            self.jsonConn.Send(sendData)            
-     
-    # Parse received data from telnet connection in localStrBuffer
-    def parseTelnet(self, localStrBuffer):
-        self.myDebug("Parse telnet buffer size " + str(len(localStrBuffer)))
+            self.jsonConn.Send(sendData)
+
+    # JSON HTTP request failed, fall back on single reads if it was a bulk read
+    #   dRequest: dictionnary: request from dqJsonFifo
+    def abortJsonRequest(self, dRequest):
+        if dRequest["request"] == "data":
+            for oRecord in dRequest["units"]:
+                self.read(oRecord, bFresh=True)
+        else:
+            self.bStillToLook = True
+
+    # Parse values received from ebusd JSON HTTP port after a bulk read, and read separately messages not found or too old
+    #   sData: string: data received
+    #   dRequest: dictionnary: request from dqJsonFifo
+    def parseJsonData(self, sData, dRequest):
+        self.myDebug("Parsing JSON values")
+        try:
+            # keep numbers as received, to get the same representation as telnet answers
+            dJson = json.loads(sData, parse_float=str, parse_int=str)
+        except Exception as e:
+            Domoticz.Error("Impossible to parse JSON values (buffer size " + str(len(sData)) + "). " + traceback.format_exc())
+            self.abortJsonRequest(dRequest)
+            return
+
+        # index received messages by circuit and message names
+        dReceived = {}
+        for sCircuit, dItem in dJson.items():
+            if isinstance(dItem, dict) and isinstance(dItem.get("messages"), dict):
+                for sMessage, dMessageItem in dItem["messages"].items():
+                    dReceived[(sCircuit.casefold(), re.sub(r'\[.*\]', '', sMessage.casefold()))] = dMessageItem
+
+        timeNow = time.time()
+        iUpdated = 0
+        for oRecord in dRequest["units"]:
+            # message may have been removed by a discovery since request has been queued
+            if (not oRecord.sCircuit in self.dUnits3D) or (not oRecord.sMessage in self.dUnits3D[oRecord.sCircuit]):
+                self.myDebug("Bulk read value ignored for circuit " + oRecord.sCircuit + " message " + oRecord.sMessage + " not anymore in dictionnary")
+                continue
+            dMessageItem = dReceived.get((oRecord.sCircuit, oRecord.sMessage))
+            lFieldsValues = None
+            if isinstance(dMessageItem, dict) and isinstance(dMessageItem.get("fields"), dict):
+                try:
+                    iLastUp = int(dMessageItem.get("lastup", 0))
+                except ValueError:
+                    iLastUp = 0
+                # value must have been seen on the bus during last period
+                if (iLastUp + self.getRefreshInterval(oRecord)) >= dRequest["timestamp"]:
+                    lFieldsValues = []
+                    # fields are in the same order as in fielddefs, ignored fields excluded
+                    for dField in dMessageItem["fields"].values():
+                        value = dField.get("value") if isinstance(dField, dict) else None
+                        if value is None:
+                            lFieldsValues.append("-")
+                        else:
+                            lFieldsValues.append(str(value))
+            if lFieldsValues is None:
+                self.myDebug("No recent value for circuit " + oRecord.sCircuit + " message " + oRecord.sMessage + ", read it")
+                # ebusd cache has just been found too old, don't let ebusd answer from it
+                self.read(oRecord, bFresh=True)
+            else:
+                iUpdated += 1
+                self.updateMessage(oRecord.sCircuit, oRecord.sMessage, lFieldsValues, min(iLastUp, timeNow), False, oRecord.sCircuit + " " + oRecord.sMessage)
+        self.myDebug("Bulk read updated " + str(iUpdated) + " messages out of " + str(len(dRequest["units"])))
+
+    # Parse received data from telnet connection in localStrBuffer, answer to the oldest command in flight
+    #   oChannel: TelnetChannel: channel that received data
+    def parseTelnet(self, oChannel, localStrBuffer):
+        self.myDebug("Parse telnet buffer size " + str(len(localStrBuffer)) + " from connection " + str(oChannel.iIndex))
+        # ebusd answers commands in sending order
+        if len(oChannel.dqInFlight) > 0:
+            dCommand = oChannel.dqInFlight.popleft()
+        else:
+            dCommand = None
         # We are interested only in first line
         lLines = localStrBuffer.splitlines()
+        if len(lLines) == 0:
+            return
         sReadValue = lLines[0]
         # Check if we received an error message
         if sReadValue[:5] == "ERR: ":
-            self.myDebug("Error from telnet client: " + sReadValue[5:])
+            if dCommand and (type(dCommand["unit"]) is UnitRecord):
+                self.myDebug("Error from telnet client for " + dCommand["operation"] + " on circuit " + dCommand["unit"].sCircuit + " message " + dCommand["unit"].sMessage + ": " + sReadValue[5:])
+                # only errors telling that the device didn't answer count for its circuit
+                if (dCommand["operation"] == "read") and sReadValue[5:].startswith(self.tNoAnswerErrors):
+                    self.circuitFailed(dCommand["unit"].sCircuit, dCommand["unit"].sMessage, time.time())
+            else:
+                self.myDebug("Error from telnet client: " + sReadValue[5:])
         else:
-            self.myDebug("Reveived value: " + repr(sReadValue))
-            # We sould receive something like "f47 OutsideTemp temp=9.56;sensor=ok"
-            # Split by space
-            lParams = sReadValue.split(" ", 2)
-            if len(lParams) >= 3:
-                # Split received fields by ;
-                sFields = lParams[2].split(";")
-                lFieldsValues = []
-                sCircuit = lParams[0].casefold()
-                sMessage = lParams[1].casefold()
-                # Look for corresponding circuit and register
-                if (sCircuit in self.dUnits3D) and (sMessage in self.dUnits3D[sCircuit]):
-                    # Extract read fields
-                    for sField in sFields:
-                        # Keep only the right of =
-                        sFieldContent = sField.split("=")
-                        # Sanity check
-                        if len(sFieldContent) == 2:
-                                # Keep read values in lFieldsValues
-                                lFieldsValues.append(sFieldContent[1])
-                        else:
-                                Domoticz.Error("Parsing error on field for value " + sReadValue)
-                    
-                    # Save whole values for later use with a timestamp
-                    sFieldsValues = ";".join(lFieldsValues)
-                    iFieldsValuesTimestamp = time.time()
-                    for dUnit in self.dUnits3D[sCircuit][sMessage].values():
-                        dUnit["fieldsvalues"] = sFieldsValues
-                        dUnit["fieldsvaluestimestamp"] = iFieldsValuesTimestamp
-                        self.myDebug("Save whole fields values " + dUnit["fieldsvalues"])						
-                        # Distribute read values for each field we are interested into
-                        if dUnit["fieldindex"] < len(lFieldsValues):
-                            sFieldValue = lFieldsValues[dUnit["fieldindex"]]
-                            iValue, sValue = valueEbusdToDomoticz(dUnit, sFieldValue)
-                            oUnit = dUnit["device"]
-                            if oUnit is not None:
-                                if (oUnit.nValue != iValue) or (oUnit.sValue != sValue):
-                                    oUnit.nValue = iValue
-                                    oUnit.sValue = sValue
-                                    oUnit.Update(Log=True)
-                                    oUnit.Parent.TimedOut=0
-                                    dUnit["forcerefresh"] = False
-                                elif dUnit["forcerefresh"] or dUnit["alwaysrefresh"] or oUnit.Parent.TimedOut:
-                                    oUnit.Parent.TimedOut=0
-                                    oUnit.Touch()
-                                    dUnit["forcerefresh"] = False
-                                else:
-                                    oUnit.Touch()
-                            else:
-                                Domoticz.Error("Received unexpected value " + sReadValue + " for device not anymore in dictionnary")
-                        else:
-                            Domoticz.Error("Field not found in unit dictionaries for circuit " + dUnit["circuit"] + " message " + dUnit["message"] + " field " + str(dUnit["fieldindex"]) + " for value " + sReadValue)
+            self.parseMessageLine(sReadValue, False)
+
+    # Count a read error of a message for its circuit, skip reads of the circuit once its already answered messages fail too, or after too many errors if none answered yet, and space probes more after each failed probe
+    #   sCircuit: string: circuit name
+    #   sMessage: string: message name
+    #   timeNow: integer: current time
+    def circuitFailed(self, sCircuit, sMessage, timeNow):
+        dBreaker = self.dCircuitBreakers.setdefault(sCircuit, {"errors": {}, "open": False, "delay": 0, "probe": 0})
+        dBreaker["errors"][sMessage] = dBreaker["errors"].get(sMessage, 0) + 1
+        iErrors = sum(dBreaker["errors"].values())
+        # a message that fails alone doesn't tell that the device is off, unless no message answered yet, for instance device already off at start
+        setAnswered = self.getAnsweredMessages(sCircuit)
+        iFailing = len(setAnswered.intersection(dBreaker["errors"]))
+        if len(setAnswered) == 0:
+            bOpen = iErrors >= self.iBreakerThreshold
+        else:
+            bOpen = (iFailing > 0) and (iFailing >= min(self.iBreakerThreshold, len(setAnswered))) and (iErrors >= self.iBreakerThreshold)
+        if dBreaker["open"]:
+            dBreaker["delay"] = min(self.iBreakerMaxDelay, dBreaker["delay"] * 2)
+            dBreaker["probe"] = timeNow + dBreaker["delay"]
+            self.myDebug("Circuit " + sCircuit + " still doesn't answer, next probe in " + str(dBreaker["delay"]) + " s")
+        elif bOpen:
+            dBreaker["open"] = True
+            dBreaker["delay"] = self.iBreakerMinDelay
+            dBreaker["probe"] = timeNow + dBreaker["delay"]
+            Domoticz.Error("Circuit " + sCircuit + " doesn't answer after " + str(iErrors) + " errors on " + str(len(dBreaker["errors"])) + " messages, its reads are suspended and its devices timed out")
+            # no need to wait for refresh deadlines, values won't come
+            for dFields in self.dUnits3D.get(sCircuit, {}).values():
+                for oRecord in dFields.values():
+                    if (oRecord.sDeviceID in Devices) and not Devices[oRecord.sDeviceID].TimedOut:
+                        Devices[oRecord.sDeviceID].TimedOut=1
+
+    # Give messages of a circuit still polled whose reads have already been answered
+    #   sCircuit: string: circuit name
+    def getAnsweredMessages(self, sCircuit):
+        return set(sMessage for sMessage in self.dAnsweredMessages.get(sCircuit, ()) if sMessage in self.dUnits3D.get(sCircuit, {}))
+
+    # Forget read errors of a circuit that answers again
+    #   sCircuit: string: circuit name
+    def circuitAnswered(self, sCircuit):
+        dBreaker = self.dCircuitBreakers.pop(sCircuit)
+        if dBreaker["open"]:
+            Domoticz.Status("Circuit " + sCircuit + " answers again, its reads are resumed")
+
+    # Tell if a refresh read can be sent for a message of a circuit, reads of a circuit that doesn't answer are skipped except a probe from time to time
+    #   sCircuit: string: circuit name
+    #   sMessage: string: message name
+    #   timeNow: integer: current time
+    def isCircuitReadable(self, sCircuit, sMessage, timeNow):
+        dBreaker = self.dCircuitBreakers.get(sCircuit)
+        if (dBreaker is None) or (not dBreaker["open"]):
+            return True
+        # probe with the message that already answered and failed the less, so that a failing message doesn't keep the circuit suspended, or with a failing message still polled if none answered yet
+        lCandidates = sorted(self.getAnsweredMessages(sCircuit))
+        if len(lCandidates) == 0:
+            lCandidates = sorted(sFailingMessage for sFailingMessage in dBreaker["errors"] if sFailingMessage in self.dUnits3D.get(sCircuit, {}))
+        if (timeNow >= dBreaker["probe"]) and (len(lCandidates) > 0) and (sMessage == min(lCandidates, key=lambda sCandidate: dBreaker["errors"].get(sCandidate, 0))):
+            # a single probe until it is answered, the next one is planned by circuitFailed
+            dBreaker["probe"] = timeNow + dBreaker["delay"]
+            return True
+        return False
+
+    # Parse received data from telnet connection in listen mode, lines are sent by ebusd each time a message is seen on the bus
+    #   Data: bytes: data received
+    def parseListen(self, Data):
+        self.baListenBuffer += Data
+        # keep incomplete last line in buffer
+        lLines, self.iListenScanPos = splitFrames(self.baListenBuffer, self.iListenScanPos, b"\n")
+        # we limit buffer size to keep memory, a line shouldn't be that big
+        if len(self.baListenBuffer) > self.iMaxReceiveSize:
+            Domoticz.Error("Line received in listen mode exceeds " + str(self.iMaxReceiveSize) + " bytes, dropped")
+            self.baListenBuffer.clear()
+            self.iListenScanPos = 0
+        for sLine in lLines:
+            sLine = sLine.strip()
+            if not sLine:
+                continue
+            if sLine[:5] == "ERR: ":
+                self.myDebug("Error from telnet listen client: " + sLine[5:])
+            elif sLine.startswith("listen "):
+                self.myDebug("Listen status: " + sLine)
+            else:
+                self.parseMessageLine(sLine, True)
+
+    # Parse a message line and distribute fields values to devices
+    #   sReadValue: string: line received, for instance "f47 OutsideTemp temp=9.56;sensor=ok" after a read or "f47 OutsideTemp = temp=9.56;sensor=ok" in listen mode
+    #   bUnsolicited: boolean: True if line comes from listen mode, messages we are not interested into are then silently ignored
+    def parseMessageLine(self, sReadValue, bUnsolicited):
+        self.myDebug("Reveived value: " + repr(sReadValue))
+        # We sould receive something like "f47 OutsideTemp temp=9.56;sensor=ok"
+        # Split by space
+        lParams = sReadValue.split(" ", 2)
+        if len(lParams) < 3:
+            return
+        sCircuit = lParams[0].casefold()
+        sMessage = lParams[1].casefold()
+        sFieldsPart = lParams[2]
+        # the circuit answers, close its breaker
+        if sCircuit in self.dCircuitBreakers:
+            self.circuitAnswered(sCircuit)
+        # the message can be used as probe
+        if not bUnsolicited:
+            self.dAnsweredMessages.setdefault(sCircuit, set()).add(sMessage)
+        # listen mode separates message name and fields with =
+        if sFieldsPart.startswith("= "):
+            sFieldsPart = sFieldsPart[2:]
+        # Look for corresponding circuit and register
+        if (sCircuit in self.dUnits3D) and (sMessage in self.dUnits3D[sCircuit]):
+            # Split received fields by ;
+            sFields = sFieldsPart.split(";")
+            lFieldsValues = []
+            # Extract read fields
+            for sField in sFields:
+                # Keep only the right of =
+                sFieldContent = sField.split("=")
+                # Sanity check
+                if len(sFieldContent) == 2:
+                        # Keep read values in lFieldsValues
+                        lFieldsValues.append(sFieldContent[1])
+                else:
+                        Domoticz.Error("Parsing error on field for value " + sReadValue)
+            self.updateMessage(sCircuit, sMessage, lFieldsValues, time.time(), bUnsolicited, sReadValue)
+        elif not bUnsolicited:
+                Domoticz.Error("Received unexpected value " + sReadValue)
+
+    # Distribute fields values of a message to devices
+    #   sCircuit: string: circuit name, lower case
+    #   sMessage: string: message name, lower case
+    #   lFieldsValues: list of strings: fields values, ignored fields excluded
+    #   iFieldsValuesTimestamp: integer: time when values have been seen on the bus
+    #   bUnsolicited: boolean: True if values come from listen mode
+    #   sReadValue: string: raw value, for logs
+    def updateMessage(self, sCircuit, sMessage, lFieldsValues, iFieldsValuesTimestamp, bUnsolicited, sReadValue):
+        # Save whole values for later use with a timestamp
+        sFieldsValues = ";".join(lFieldsValues)
+        oFirstRecord = next(iter(self.dUnits3D[sCircuit][sMessage].values()), None)
+        # no previous value after discovery, nothing to compare to
+        if oFirstRecord and (oFirstRecord.sFieldsValues is not None):
+            self.adaptRefreshInterval(sCircuit, sMessage, oFirstRecord.sFieldsValues != sFieldsValues, iFieldsValuesTimestamp)
+        iDeadline = iFieldsValuesTimestamp + (3 * self.dMessageStates[(sCircuit, sMessage)]["interval"])
+        for oRecord in self.dUnits3D[sCircuit][sMessage].values():
+            oRecord.sFieldsValues = sFieldsValues
+            oRecord.iFieldsValuesTimestamp = iFieldsValuesTimestamp
+            # a later deadline is taken into account when the current heap entry expires, only an earlier one needs a new entry
+            iCurrentDeadline = self.dTimeoutDeadlines.get(oRecord.sDeviceID)
+            if (iCurrentDeadline is None) or (iDeadline < iCurrentDeadline):
+                self.scheduleTimeout(oRecord.sDeviceID, iDeadline)
+            # ebusd also reports in listen mode messages read by ourself, ignore them if we are waiting for an answer
+            if bUnsolicited and ((oRecord.iReadTimestamp + self.iTimeoutConstant) < iFieldsValuesTimestamp):
+                oRecord.iListenTimestamp = iFieldsValuesTimestamp
+            self.myDebug("Save whole fields values " + oRecord.sFieldsValues)
+            # Distribute read values for each field we are interested into
+            if oRecord.iFieldIndex < len(lFieldsValues):
+                sFieldValue = lFieldsValues[oRecord.iFieldIndex]
+                iValue, sValue = oRecord.fnToDomoticz(sFieldValue)
+                oUnit = oRecord.oDevice
+                if oUnit is not None:
+                    bChanged = (oUnit.nValue != iValue) or (oUnit.sValue != sValue)
+                    # small or too frequent changes of numeric values only touch the device, to limit database writes
+                    if bChanged and (not oRecord.bForceRefresh) and self.isChangeFiltered(oRecord, oUnit, sValue, iFieldsValuesTimestamp):
+                        bChanged = False
+                    if bChanged:
+                        oUnit.nValue = iValue
+                        oUnit.sValue = sValue
+                        oUnit.Update(Log=True)
+                        oUnit.Parent.TimedOut=0
+                        oRecord.bForceRefresh = False
+                        oRecord.iUpdateTimestamp = iFieldsValuesTimestamp
+                    elif oRecord.bForceRefresh or oRecord.bAlwaysRefresh or oUnit.Parent.TimedOut:
+                        oUnit.Parent.TimedOut=0
+                        oUnit.Touch()
+                        oRecord.bForceRefresh = False
+                    else:
+                        oUnit.Touch()
                 else:
-                        Domoticz.Error("Received unexpected value " + sReadValue)
-                            
-        # Data received, going back to "connected" connection step
-        self.sConnectionStep = "connected"
-        # Handle fifo if there are still command to proceed
-        self.handleFifo()
-
-    # parse JSON data received from ebusd
+                    Domoticz.Error("Received unexpected value " + sReadValue + " for device not anymore in dictionnary")
+            else:
+                Domoticz.Error("Field not found in unit dictionaries for circuit " + oRecord.sCircuit + " message " + oRecord.sMessage + " field " + str(oRecord.iFieldIndex) + " for value " + sReadValue)
+
+    # Tell if the change of a numeric value is inside the deadband of its field type or too close to previous update
+    #   oRecord: UnitRecord: unit
+    #   oUnit: object: unit in Devices dict
+    #   sValue: string: new domoticz string value
+    #   timeNow: integer: time of the new value
+    def isChangeFiltered(self, oRecord, oUnit, sValue, timeNow):
+        if (oRecord.fDeadband <= 0) and (self.iParamMinUpdate <= 0):
+            return False
+        # selectors, switches and setpoints are always updated
+        if oRecord.dOptions or (oRecord.sFieldType == "switchonoff") or (oRecord.sFieldType == "switchyesno") or (oUnit.Type == 0xF2):
+            return False
+        try:
+            fDifference = abs(float(sValue) - float(oUnit.sValue))
+        except ValueError:
+            return False
+        if fDifference < oRecord.fDeadband:
+            self.myDebug("Change of " + oRecord.sDeviceID + " from " + oUnit.sValue + " to " + sValue + " inside deadband")
+            return True
+        if timeNow < (oRecord.iUpdateTimestamp + self.iParamMinUpdate):
+            self.myDebug("Change of " + oRecord.sDeviceID + " from " + oUnit.sValue + " to " + sValue + " delayed by min update interval")
+            return True
+        return False
+
+    # Compile search and exclude patterns from registers parameter, for registers and for circuits
+    def buildRegExFilters(self):
+        if self.bRegExFilled:
+            return
+        self.bRegExFilled = True
+        lUnits = self.lParamRegisters
+        lUnitsSearch = []
+        lUnitsExclude = []
+        for sUnit in lUnits:
+            if sUnit.startswith("!"):
+                sUnitFixed = sUnit[1:]
+                if sUnitFixed:
+                    lUnitsExclude.append(sUnitFixed)
+            else:
+                lUnitsSearch.append(sUnit)
+        if len(lUnitsSearch) == 0 :
+            self.sRegExSearch = re.compile(".*", re.IGNORECASE)
+        else:
+            self.sRegExSearch = re.compile("|".join(lUnitsSearch), re.IGNORECASE)
+        if len(lUnitsExclude) > 0 :
+            self.sRegExExclude = re.compile("|".join(lUnitsExclude), re.IGNORECASE)
+
+        # registers are circuit:message:field, search patterns match anywhere in it
+        # only a pattern anchored at start with a literal circuit name before the first ":" can't match past it, others may match any circuit
+        self.lRegExSearchCircuits = []
+        for sUnit in lUnitsSearch:
+            sCircuitPattern, sSeparator, _ = sUnit.partition(":")
+            oRegEx = None
+            if sSeparator and not ("|" in sUnit) and re.fullmatch(r"\^(?:[\w-]|\\\.)+", sCircuitPattern):
+                try:
+                    oRegEx = re.compile(sCircuitPattern + "$", re.IGNORECASE)
+                except re.error:
+                    pass
+            if oRegEx is None:
+                self.lRegExSearchCircuits = None
+                break
+            self.lRegExSearchCircuits.append(oRegEx)
+        if len(lUnitsSearch) == 0:
+            self.lRegExSearchCircuits = None
+        # an exclude pattern matching circuit: excludes all registers of the circuit, unless it depends on what follows
+        self.lRegExExcludeCircuits = []
+        for sUnit in lUnitsExclude:
+            if not any(sToken in sUnit for sToken in ("$", "(?", "\\b", "\\B", "\\Z")):
+                try:
+                    self.lRegExExcludeCircuits.append(re.compile(sUnit, re.IGNORECASE))
+                except re.error:
+                    pass
+
+    # Tell if registers of a circuit can match search and exclude patterns
+    #   sCircuit: string: circuit name, lowered
+    def isCircuitSelected(self, sCircuit):
+        self.buildRegExFilters()
+        if any(oRegEx.search(sCircuit + ":") for oRegEx in self.lRegExExcludeCircuits):
+            return False
+        if self.lRegExSearchCircuits is None:
+            return True
+        return any(oRegEx.search(sCircuit) for oRegEx in self.lRegExSearchCircuits)
+
+    # Parse list of circuits received from ebusd JSON HTTP port, and request definitions of circuits that can match registers and changed since last parse
+    #   sData: string: data received
+    def parseJsonCircuits(self, sData):
+        self.bStillToLook = False
+        self.myDebug("Parsing JSON circuits")
+        try:
+            dGlobal, dCircuits = countEbusdMessages(sData)
+        except Exception as e:
+            self.bStillToLook = True
+            Domoticz.Error("Impossible to parse JSON circuits (buffer size " + str(len(sData)) + "). " + traceback.format_exc())
+            return
+        if ("messages" not in dGlobal) or (dGlobal["messages"] == 0):
+            self.bStillToLook = True
+            self.myDebug("No usable messages, will try again later")
+            return
+        # circuits of registers that couldn't be added last time must be requested again
+        setRetryCircuits = set(sRegister.split(":", 1)[0] for sRegister in self.setRetryRegisters)
+        iRequested = 0
+        for sCircuit, (sCircuitName, iCount) in dCircuits.items():
+            if (sCircuit == "global") or sCircuit.startswith("scan."):
+                continue
+            if not self.isCircuitSelected(sCircuit):
+                self.myDebug("Circuit " + sCircuit + " can't match registers, skipped")
+                continue
+            if (self.dCircuitCounts.get(sCircuit) == iCount) and not (sCircuit in setRetryCircuits):
+                continue
+            self.myDebug("Request definitions of circuit " + sCircuit + " with " + str(iCount) + " messages")
+            self.dqJsonFifo.append({"request": "find", "url": "/data/" + sCircuitName + "?def&write", "circuit": sCircuit, "count": iCount, "global": dGlobal})
+            iRequested += 1
+        if iRequested == 0:
+            self.myDebug("No new messages to parse, will try again later")
+
+    # Parse definitions received from ebusd JSON HTTP port, for all circuits or a single circuit
     #   sData: string: data received
-    def parseJson(self, sData):
+    #   dRequest: dictionnary: request from dqJsonFifo
+    def parseJson(self, sData, dRequest):
         self.bStillToLook = False
         self.myDebug("Parsing JSON data")
         try:
-            dJson = json.loads(sData, object_pairs_hook= lambda dict: CaseInsensitiveDict(dict))
-            # dJson = json.loads(sData)
+            dJson = parseEbusdSchema(sData)
         except Exception as e:
             self.bStillToLook = True
             Domoticz.Error("Impossible to parse JSON (buffer size " + str(len(sData)) + "). " + traceback.format_exc())
             return     
 
         iCount = 0
+        if ("global" not in dJson) and ("global" in dRequest):
+            dJson["global"] = dRequest["global"]
         if ("global" in dJson) and ("messages" in dJson["global"]):
             iCount = dJson["global"]["messages"]
         if iCount == 0:
             self.bStillToLook = True
             self.myDebug("No usable messages, will try again later")
             return
-        if iCount == self.iJsonObjects:
+        if ("circuit" in dRequest):
+            self.dCircuitCounts[dRequest["circuit"]] = dRequest["count"]
+        # registers that couldn't be added last time are looked for again even if messages count didn't change
+        elif (iCount == self.iJsonObjects) and (len(self.setRetryRegisters) == 0):
             self.myDebug("No new messages to parse, will try again later")
             return
         
         # self.myDebug("Building messages list for " + str(iCount) + " messages")
         self.bStillToLook = True
         self.iJsonObjects = iCount
+        # registers to look for, only for messages added or changed since last parse, and registers that couldn't be added last time
+        lNewRegisters = list(self.setRetryRegisters)
+        self.setRetryRegisters = set()
+        self.indexDevices()
         if iCount:
-            self.dMessages = {}
             for sCircuit, dItem in dJson.items():
                 sCircuit = sCircuit.casefold()
                 if sCircuit == "global":
@@ -373,51 +1092,72 @@ class BasePlugin:
                     continue
                 # self.myDebug("Exploring circuit " + sCircuit)
                 if ("messages" in dItem) and (sCircuit != "global"):
-                    for sMessage, dMessageItem in dItem["messages"].items():                                                         
-                        # self.myDebug("Exploring message " + sMessage)
-                        if ("name" in dMessageItem) and dMessageItem["name"] and ("fielddefs" in dMessageItem) and (len(dMessageItem["fielddefs"]) > 0):
-                            sMessage = sMessage.casefold()
-                            sMessage = re.sub(r'\[.*\]', '', sMessage)
+                    # signature of definition of each message, to find what changed since last parse, see getMessageSignature()
+                    dSignatures = {}
+                    for sMessage, dMessageItem in dItem["messages"].items():
+                        if ("name" in dMessageItem) and dMessageItem["name"] and ("fieldsindex" in dMessageItem) and (len(dMessageItem["fielddefs"]) > 0):
+                            sMessage = re.sub(r'\[.*\]', '', sMessage.casefold())
+                            dSignatures[sMessage] = getMessageSignature(dItem["messages"], sMessage)
+                    dPreviousSignatures = self.dSchemaSignatures.get(sCircuit, {})
+                    if dSignatures == dPreviousSignatures:
+                        self.myDebug("Circuit " + sCircuit + " unchanged since last parse")
+                        continue
+                    self.dSchemaSignatures[sCircuit] = dSignatures
+                    # a change of writable message changes its read message
+                    setChanged = set()
+                    for sMessage in set(dSignatures) | set(dPreviousSignatures):
+                        if dSignatures.get(sMessage) != dPreviousSignatures.get(sMessage):
                             if sMessage.endswith("-w"):
-                                continue
-                            # self.myDebug("Add " + sCircuit+":"+sMessage + " to messages list")
-                            # self.dMessages[sCircuit+":"+sMessage] = dMessageItem
-                            iFieldsCount = 0
-                            for iAllFieldsIndex, dAllFieldDefs in enumerate(dMessageItem["fielddefs"]):
-                                sAllFieldType = getFieldType(dAllFieldDefs)
-                                if sAllFieldType != "ignore":
-                                    self.myDebug("Add " + sCircuit+":"+sMessage+":"+str(iFieldsCount) + " to messages list by field id")
-                                    self.dMessages[sCircuit+":"+sMessage+":"+str(iFieldsCount)] = dMessageItem
-                                    iFieldsCount += 1
-                                    if "name" in dAllFieldDefs and dAllFieldDefs["name"] :
-                                        self.myDebug("Add " + sCircuit+":"+sMessage+":"+dAllFieldDefs["name"] + " to messages list by field name")
-                                        self.dMessages[sCircuit+":"+sMessage+":"+dAllFieldDefs["name"].casefold()] = dMessageItem
+                                setChanged.add(sMessage[:-2])
+                            else:
+                                setChanged.add(sMessage)
+                    for sMessage in setChanged:
+                        # forget previous definition and units of changed or removed message
+                        self.forgetMessage(sCircuit, sMessage)
+                        if not sMessage in dSignatures:
+                            continue
+                        dMessageItem = dItem["messages"][sMessage]
+                        # self.myDebug("Add " + sCircuit+":"+sMessage + " to messages list")
+                        # self.dMessages[sCircuit+":"+sMessage] = dMessageItem
+                        lKeys = []
+                        for iFieldIndex, iAllFieldsIndex in enumerate(dMessageItem["fieldsindex"]["absolute"]):
+                            dAllFieldDefs = dMessageItem["fielddefs"][iAllFieldsIndex]
+                            self.myDebug("Add " + sCircuit+":"+sMessage+":"+str(iFieldIndex) + " to messages list by field id")
+                            lKeys.append(sCircuit+":"+sMessage+":"+str(iFieldIndex))
+                            if "name" in dAllFieldDefs and dAllFieldDefs["name"] :
+                                self.myDebug("Add " + sCircuit+":"+sMessage+":"+dAllFieldDefs["name"] + " to messages list by field name")
+                                lKeys.append(sCircuit+":"+sMessage+":"+dAllFieldDefs["name"].casefold())
+                        for sKey in lKeys:
+                            self.dMessages[sKey] = dMessageItem
+                        self.dMessageKeys[(sCircuit, sMessage)] = lKeys
+                        lNewRegisters.extend(lKeys)
+        self.myDebug(str(len(lNewRegisters)) + " registers to look for")
                                         
         timeNow = time.time()
         
-        if not self.bRegExFilled:
-            self.bRegExFilled = True
-            lUnits = shlex.split(self.sParamRegisters.strip())
-            lUnitsSearch = []
-            lUnitsExclude = []
-            for sUnit in lUnits:
-                if sUnit.startswith("!"):
-                    sUnitFixed = sUnit[1:]
-                    if sUnitFixed:
-                        lUnitsExclude.append(sUnitFixed)
-                else:
-                    lUnitsSearch.append(sUnit)
-            if len(lUnitsSearch) == 0 :
-                self.sRegExSearch = re.compile(".*", re.IGNORECASE)
-            else:
-                self.sRegExSearch = re.compile("|".join(lUnitsSearch), re.IGNORECASE)
-            if len(lUnitsExclude) > 0 :
-                self.sRegExExclude = re.compile("|".join(lUnitsExclude), re.IGNORECASE)
+        self.buildRegExFilters()
         
         self.myDebug("Search pattern is " + str(self.sRegExSearch))
         self.myDebug("Exclude pattern is " + str(self.sRegExExclude))
+
+        # keep track of ebusd configuration, saved with schema cache
+        self.dEbusdSignature = {"version": str(dJson["global"]["version"]) if "version" in dJson["global"] else "", "messages": iCount}
+        bSchemaChanged = False
+        # signatures of definitions of messages of units found in this JSON data
+        dSignatures = {}
+        for oRecord in self.dUnitsByDeviceID.values():
+            if (type(oRecord) is UnitRecord) and (oRecord.sCircuit in dJson) and ("messages" in dJson[oRecord.sCircuit]):
+                tKey = (oRecord.sCircuit, oRecord.sMessage)
+                if not tKey in dSignatures:
+                    dSignatures[tKey] = getMessageSignature(dJson[oRecord.sCircuit]["messages"], oRecord.sMessage)
+                # definition of message didn't change since schema cache has been saved, unit restored from cache is valid, else it's checked again below
+                if oRecord.bCached and (dSignatures[tKey] == self.dDefinitionSignatures.get(tKey)):
+                    oRecord.bCached = False
             
-        for sRegister in self.dMessages:
+        for iRegisterIndex, sRegister in enumerate(lNewRegisters):
+            # message may have been removed since register was kept for retry
+            if not sRegister in self.dMessages:
+                continue
             # sDeviceIDField0 = sRegister + ":0"
             # if not (sRegister in self.dUnitsByDeviceID) and (self.sRegExSearch.search(sRegister) or self.sRegExSearch.fullmatch(sDeviceIDField0)):
             if self.sRegExSearch.search(sRegister):
@@ -428,6 +1168,10 @@ class BasePlugin:
                 sCircuit = lPath[0]
                 sMessage = lPath[1]
                 sFieldIndex = lPath[2]
+                # circuit kept for retry may be missing from this JSON data
+                if not sCircuit in dJson:
+                    self.setRetryRegisters.add(sRegister)
+                    continue
                 # check if writable
                 sWKey = sMessage + "-w"
                 if (not self.bParamReadOnly) and (sWKey in dJson[sCircuit]["messages"]) and ("write" in dJson[sCircuit]["messages"][sWKey]) and dJson[sCircuit]["messages"][sWKey]["write"] :
@@ -440,30 +1184,21 @@ class BasePlugin:
 
                 # try to get fieldnumber, if not an integer, try by name
                 self.myDebug("Look for register " + sCircuit + ":" + sMessage + ":" + sFieldIndex + " in JSON data")
-                iFieldsCount = 0
+                dFieldsIndex = dMessage["fieldsindex"]
+                # total number of usable fields, all of them are written at once
+                iFieldsCount = len(dFieldsIndex["absolute"])
                 iFieldAbsoluteIndex = -1
                 sFieldName = ""
                 if sFieldIndex.isdigit():
                     iFieldIndex = int(sFieldIndex)
-                    for iAllFieldsIndex, dAllFieldDefs in enumerate(dMessage["fielddefs"]):
-                        sAllFieldType = getFieldType(dAllFieldDefs)
-                        if sAllFieldType != "ignore":
-                            if iFieldIndex == iFieldsCount:
-                                iFieldAbsoluteIndex = iAllFieldsIndex                                    
-                                sFieldName = dAllFieldDefs["name"].casefold()
-                                break
-                            iFieldsCount += 1
-                else:
-                    for iAllFieldsIndex, dAllFieldDefs in enumerate(dMessage["fielddefs"]):
-                        sAllFieldType = getFieldType(dAllFieldDefs)
-                        if sAllFieldType != "ignore":
-                            if dAllFieldDefs["name"].casefold() == sFieldIndex:
-                                iFieldIndex = iFieldsCount
-                                sFieldName = sFieldIndex
-                                iFieldAbsoluteIndex = iAllFieldsIndex                                    
-                                self.myDebug("Field number of register " + sRegister + " is " + str(iFieldIndex))
-                                break
-                            iFieldsCount += 1
+                    if iFieldIndex < iFieldsCount:
+                        iFieldAbsoluteIndex = dFieldsIndex["absolute"][iFieldIndex]
+                        sFieldName = dMessage["fielddefs"][iFieldAbsoluteIndex].get("name", "").casefold()
+                elif sFieldIndex in dFieldsIndex["names"]:
+                    iFieldIndex = dFieldsIndex["names"][sFieldIndex]
+                    sFieldName = sFieldIndex
+                    iFieldAbsoluteIndex = dFieldsIndex["absolute"][iFieldIndex]
+                    self.myDebug("Field number of register " + sRegister + " is " + str(iFieldIndex))
                 if iFieldAbsoluteIndex < 0:
                         Domoticz.Error("Cannot find usable field for device " + sRegister)
                         # error on this item, mark device as erroneous and go to next item
@@ -494,13 +1229,13 @@ class BasePlugin:
                 else:
                     sDeviceIntegerIDAndName = sDeviceIntegerID
                 
-                # we skip if already added (by field id or field name or previous parse)
-                if sDeviceIntegerID in self.dUnitsByDeviceID:
+                # we skip if already added (by field id or field name or previous parse), units restored from cache are checked again
+                if (sDeviceIntegerID in self.dUnitsByDeviceID) and not ((type(self.dUnitsByDeviceID[sDeviceIntegerID]) is UnitRecord) and self.dUnitsByDeviceID[sDeviceIntegerID].bCached):
                     self.myDebug("Device " + sRegister + " skiped because already in dict")
                     continue
                 
                 dFieldDefs = dMessage["fielddefs"][iFieldAbsoluteIndex]
-                sFieldType = getFieldType(dFieldDefs)
+                sFieldType = dFieldsIndex["types"][iFieldAbsoluteIndex]
                 self.myDebug("Field is type " + sFieldType)
 
                 #sTypeName = ""
@@ -608,30 +1343,26 @@ class BasePlugin:
                     sComment = " - " + dFieldDefs["comment"]
                 else:
                     sComment = ""
-                for sCurrentDeviceID, oDevice in Devices.items():
-                    # .casefold() for backward compatibility
-                    if sCurrentDeviceID.casefold() == sDeviceIntegerID:
-                        sDeviceIntegerID = sCurrentDeviceID
-                        for iIndexUnit, oUnit in oDevice.Units.items():
-                            # log device found, with dFieldDefs["name"] and dFieldDefs["comment"] giving hints on how to use register
-                            Domoticz.Status("Device detected: " + oUnit.Name + " unit " + str(iIndexUnit) + " and register " + sDeviceIntegerIDAndName + sComment)
-                            if (oUnit.Type != iMainType) or (oUnit.SubType != iSubType) or (bCheckSwitchType02 and ((not bWritable and (iSwitchType == 0)) or (bWritable and (iSwitchType == 2)))):
-                                if (self.iBuild >= 16100) or (self.iVersion > 2024000004) :
-                                    Domoticz.Status("Device " + sDeviceIntegerID + " type changed, updating Domoticz database as type " + str(iMainType) + ", subtype " + str(iSubType) + " and switchtype " + str(iSwitchType))
-                                    bForceRefresh = True
-                                    oUnit.Type=iMainType
-                                    oUnit.SubType=iSubType
-                                    oUnit.SwitchType=iSwitchType
-                                    oUnit.Image=iImage
-                                    oUnit.Options=dOptions
-                                    oUnit.Update(Log=False, UpdateProperties=True, UpdateOptions=True)
-                                    oUnit.Parent.TimedOut=0
-                                else:
-                                    Domoticz.Error("Device " + sDeviceIntegerID + " type is incorrect, you should consider deleting it and restart the plugin")
-                            # if found, continue loop to next item
-                            bFound = True
-                            break
-                        break
+                # .casefold() for backward compatibility
+                if sDeviceIntegerID in self.dDeviceIDIndex:
+                    sDeviceIntegerID, iIndexUnit = self.dDeviceIDIndex[sDeviceIntegerID]
+                    oUnit = Devices[sDeviceIntegerID].Units[iIndexUnit]
+                    # log device found, with dFieldDefs["name"] and dFieldDefs["comment"] giving hints on how to use register
+                    Domoticz.Status("Device detected: " + oUnit.Name + " unit " + str(iIndexUnit) + " and register " + sDeviceIntegerIDAndName + sComment)
+                    if (oUnit.Type != iMainType) or (oUnit.SubType != iSubType) or (bCheckSwitchType02 and ((not bWritable and (iSwitchType == 0)) or (bWritable and (iSwitchType == 2)))):
+                        if (self.iBuild >= 16100) or (self.iVersion > 2024000004) :
+                            Domoticz.Status("Device " + sDeviceIntegerID + " type changed, updating Domoticz database as type " + str(iMainType) + ", subtype " + str(iSubType) + " and switchtype " + str(iSwitchType))
+                            bForceRefresh = True
+                            oUnit.Type=iMainType
+                            oUnit.SubType=iSubType
+                            oUnit.SwitchType=iSwitchType
+                            oUnit.Image=iImage
+                            oUnit.Options=dOptions
+                            oUnit.Update(Log=False, UpdateProperties=True, UpdateOptions=True)
+                            oUnit.Parent.TimedOut=0
+                        else:
+                            Domoticz.Error("Device " + sDeviceIntegerID + " type is incorrect, you should consider deleting it and restart the plugin")
+                    bFound = True
 
                 # not in database: add device
                 if not bFound:
@@ -657,23 +1388,34 @@ class BasePlugin:
                     # create device, log dFieldDefs["name"] and dFieldDefs["comment"] giving hints on how to use register
                     Domoticz.Unit(Name=sCompleteName, Unit=iIndexUnit, Type=iMainType, Subtype=iSubType, Switchtype=iSwitchType, Image=iImage, Description=dFieldDefs["comment"], Options=dOptions, Used=iUsed, DeviceID=sDeviceIntegerID).Create()
                     if (sDeviceIntegerID in Devices) and (iIndexUnit in Devices[sDeviceIntegerID].Units):
+                        self.onDeviceAdded(sDeviceIntegerID, iIndexUnit)
                         Domoticz.Status("Add register " + sDeviceIntegerIDAndName + " unit " + str(iIndexUnit) + " as type " + str(iMainType) + ", subtype " + str(iSubType) + " and switchtype " + str(iSwitchType) + sComment)
                     else:
                         Domoticz.Error("Cannot add register " + sDeviceIntegerIDAndName + " unit " + str(iIndexUnit) + ". Check in settings that Domoticz is set up to accept new devices")
                         self.bStillToLook = True
+                        # try again remaining registers during next parse
+                        self.setRetryRegisters.update(lNewRegisters[iRegisterIndex:])
                         break
                     
                 # incorporate found or created device to local self.dUnits dictionnaries, to keep additionnal parameters used by the plugin
-                self.dUnitsByDeviceID[sDeviceIntegerID] = { "device":Devices[sDeviceIntegerID].Units[iIndexUnit], "circuit":sCircuit, "message":sMessage, "fieldindex":iFieldIndex, "fieldscount":iFieldsCount, "options":dOptionsMapping, "reverseoptions":dReverseOptionsMapping, "domoticzoptions": dOptions, "fieldtype": sFieldType, "forcerefresh": bForceRefresh, "alwaysrefresh": bAlwaysRefresh }
-                # set fieldsvaluestimestamp for read then write timeout
-                self.dUnitsByDeviceID[sDeviceIntegerID]["fieldsvaluestimestamp"] = timeNow - (2 * self.iTimeoutConstant)
-                if not sCircuit in self.dUnits3D:
-                    self.dUnits3D[sCircuit] = {}
-                if not sMessage in self.dUnits3D[sCircuit]:
-                    self.dUnits3D[sCircuit][sMessage] = {}
-                self.dUnits3D[sCircuit][sMessage][iFieldIndex] = self.dUnitsByDeviceID[sDeviceIntegerID]
-                # place a read command in the queue for each device to refresh its value asap
-                self.read(self.dUnitsByDeviceID[sDeviceIntegerID])
+                lRegisterKeys = [sRegister, sDeviceIntegerID]
+                if sFieldName:
+                    lRegisterKeys.append(sDeviceIntegerName)
+                self.addUnit(sDeviceIntegerID, iIndexUnit, UnitRecord(sCircuit, sMessage, iFieldIndex, iFieldsCount, dOptionsMapping, dReverseOptionsMapping, dOptions, sFieldType, bForceRefresh, bAlwaysRefresh, lRegisterKeys), timeNow)
+                self.dDefinitionSignatures[(sCircuit, sMessage)] = getMessageSignature(dJson[sCircuit]["messages"], sMessage)
+                bSchemaChanged = True
+
+        # forget units restored from cache whose message doesn't exist anymore in a circuit still present
+        setMessages = set(sRegister.rsplit(":", 1)[0] for sRegister in self.dMessages)
+        setCircuits = set(sRegister.split(":", 1)[0] for sRegister in self.dMessages)
+        for sDeviceID, oRecord in list(self.dUnitsByDeviceID.items()):
+            if (type(oRecord) is UnitRecord) and oRecord.bCached and (oRecord.sCircuit in setCircuits) and not ((oRecord.sCircuit + ":" + oRecord.sMessage) in setMessages):
+                Domoticz.Status("Register " + sDeviceID + " restored from cache not found anymore in ebusd configuration")
+                self.removeUnit(sDeviceID)
+                bSchemaChanged = True
+
+        if bSchemaChanged:
+            self.saveSchemaCache()
 
         self.myDebug("End of parsing JSON data")
 
@@ -694,6 +1436,48 @@ class BasePlugin:
         except ValueError:
             Domoticz.Error("JSON port parameter incorrect, set to its default value")
         self.sParamRegisters = Parameters["Mode2"]
+        self.parseRegistersParameter(self.sParamRegisters)
+        self.bParamListen = "listen" in self.dParamOptions
+        self.bParamBulk = "bulk" in self.dParamOptions
+        self.bParamSelective = "selective" in self.dParamOptions
+        self.bParamAdaptive = "adaptive" in self.dParamOptions
+        self.dParamDeadbands = {}
+        if "deadband" in self.dParamOptions:
+            self.dParamDeadbands = dict(self.dDefaultDeadbands)
+            # list of fieldtype:deadband separated by commas
+            for sDeadband in self.dParamOptions["deadband"].split(","):
+                if sDeadband:
+                    sFieldType, _, sValue = sDeadband.partition(":")
+                    try:
+                        self.dParamDeadbands[sFieldType.strip().casefold()] = abs(float(sValue))
+                    except ValueError:
+                        Domoticz.Error("Deadband option incorrect for " + sDeadband + ", ignored")
+        try:
+            self.iParamMinUpdate = max(0, int(self.dParamOptions.get("minupdate", "0")))
+        except ValueError:
+            Domoticz.Error("Min update option incorrect, set to its default value")
+            self.iParamMinUpdate = 0
+        try:
+            self.iParamDebounce = max(0, int(self.dParamOptions.get("debounce", "0")))
+        except ValueError:
+            Domoticz.Error("Debounce option incorrect, set to its default value")
+            self.iParamDebounce = 0
+        if "maxage" in self.dParamOptions:
+            try:
+                self.iParamMaxAge = max(0, int(self.dParamOptions["maxage"]))
+            except ValueError:
+                Domoticz.Error("Max age option incorrect, set to its default value")
+                self.iParamMaxAge = None
+        try:
+            self.iParamPipeline = max(1, int(self.dParamOptions.get("pipeline", "1")))
+        except ValueError:
+            Domoticz.Error("Pipeline option incorrect, set to its default value")
+            self.iParamPipeline = 1
+        try:
+            self.iParamConnections = max(1, int(self.dParamOptions.get("connections", "1")))
+        except ValueError:
+            Domoticz.Error("Connections option incorrect, set to its default value")
+            self.iParamConnections = 1
 
         try:
             self.iParamRefreshRate = int(Parameters["Mode3"])
@@ -731,8 +1515,19 @@ class BasePlugin:
         Domoticz.Log("Telnet port set to " + str(self.iParamTelnetPort))
         Domoticz.Log("JSON  HTTP port set to " + str(self.iParamJsonPort))
         Domoticz.Log("Refresh rate set to " + str(self.iParamRefreshRate))
-        Domoticz.Log("Registers set to " + self.sParamRegisters)
+        Domoticz.Log("Registers set to " + " ".join(self.lParamRegisters))
+        Domoticz.Log("Options set to " + str(self.dParamOptions))
+        Domoticz.Log("Listen mode set to " + str(self.bParamListen))
+        Domoticz.Log("Bulk refresh set to " + str(self.bParamBulk))
+        Domoticz.Log("Selective discovery set to " + str(self.bParamSelective))
+        Domoticz.Log("Adaptive refresh set to " + str(self.bParamAdaptive))
+        Domoticz.Log("Pipeline set to " + str(self.iParamPipeline))
+        Domoticz.Log("Telnet connections set to " + str(self.iParamConnections))
         Domoticz.Log("Disable cache set to " + str(self.bParamDisableCache))
+        Domoticz.Log("Max age of cached values set to " + str(self.iParamMaxAge))
+        Domoticz.Log("Debounce time of writes set to " + str(self.iParamDebounce))
+        Domoticz.Log("Deadbands set to " + str(self.dParamDeadbands))
+        Domoticz.Log("Min update interval set to " + str(self.iParamMinUpdate))
         Domoticz.Log("Read-only set to " + str(self.bParamReadOnly))
         Domoticz.Log("Auto add set to " + str(self.bParamAutoAdd))
         Domoticz.Log("Debug set to " + str(self.iParamDebug))
@@ -744,11 +1539,18 @@ class BasePlugin:
         if self.iParamDebug > 1:
             Domoticz.Debugging(1)            
 
-        # set heartbeat interval
-        if self.iParamRefreshRate < self.iMaxHeartbeatInterval:
-            Domoticz.Heartbeat(self.iParamRefreshRate)
+        # set heartbeat interval, registers may have a faster refresh rate than the one given in parameters
+        iMinRefreshRate = self.iParamRefreshRate
+        for oRegEx, dOptions in self.lParamRegistersOptions:
+            if dOptions.get("refresh", "").isdigit():
+                iMinRefreshRate = min(iMinRefreshRate, max(1, int(dOptions["refresh"])))
+        if self.bParamAdaptive or any("adaptive" in dOptions for oRegEx, dOptions in self.lParamRegistersOptions):
+            iMinRefreshRate = min(iMinRefreshRate, int(iMinRefreshRate * self.fAdaptiveMinRatio))
+        if iMinRefreshRate < self.iMaxHeartbeatInterval:
+            self.iHeartbeatInterval = max(1, iMinRefreshRate)
         else:
-            Domoticz.Heartbeat(self.iMaxHeartbeatInterval)
+            self.iHeartbeatInterval = self.iMaxHeartbeatInterval
+        Domoticz.Heartbeat(self.iHeartbeatInterval)
 
         # we need to let at least 2 heartbeats before discovering to launch discovering then populate dUnits dict
         if self.iDiscoverTime < (3 * self.iParamRefreshRate):
@@ -759,20 +1561,36 @@ class BasePlugin:
         # Ignore username and password, I'm not sure when I should authenticate and it can be handled by ACL file directly by ebusd
         #if Parameters["Username"] != "":
             #self.dqFifo.append({"operation":"authenticate"})
-        # first scan of available registers
+        # restore units discovered during last run, to start polling without waiting for JSON data
+        if ("HomeFolder" in Parameters) and ("HardwareID" in Parameters):
+            self.sSchemaCacheFile = Parameters["HomeFolder"] + "ebusd_schema_" + str(Parameters["HardwareID"]) + ".json"
+            self.sSnapshotFile = Parameters["HomeFolder"] + "ebusd_values_" + str(Parameters["HardwareID"]) + ".json"
+        # values of last run are restored when units are added, only stale values are read at once
+        self.loadSnapshot()
+        self.loadSchemaCache()
+        # first scan of available registers, units restored from cache will be reconciled
         self.findDevices()
+        # receive messages seen on the bus
+        if self.bParamListen:
+            self.listen()
 
     def onStop(self):
         Domoticz.Debug("onStop called")
+        if self.bIsStarted:
+            self.saveSnapshot()
         # prevent error messages during disabling plugin
         self.bIsStarted = False
         # close connections
-        if self.telnetConn != None:
-            if self.telnetConn.Connected():
-                self.telnetConn.Disconnect()
+        for oChannel in self.lChannels:
+            if oChannel.telnetConn != None:
+                if oChannel.telnetConn.Connected():
+                    oChannel.telnetConn.Disconnect()
         if self.jsonConn != None:
             if self.jsonConn.Connected():
                 self.jsonConn.Disconnect()
+        if self.listenConn != None:
+            if self.listenConn.Connected():
+                self.listenConn.Disconnect()
         self.__init__()        
 
     def onConnect(self, Connection, Status, Description):
@@ -780,11 +1598,19 @@ class BasePlugin:
         if self.bIsStarted:
             if ((Connection == self.jsonConn) and (Status == 0)):
                 self.myDebug("onConnect for json called")
-                self.findDevices()
-            elif ((Connection == self.telnetConn) and (Status == 0)):
-                self.myDebug("onConnect for telnet called")
-                self.sConnectionStep = "connected"
-                self.handleFifo()
+                self.handleJsonFifo()
+            elif ((Connection == self.listenConn) and (Status == 0)):
+                self.myDebug("onConnect for telnet listen called")
+                # verbose mode to get fields names, as with read command
+                self.listenConn.Send("listen -v\r\n")
+            else:
+                oChannel = self.getChannelByConnection(Connection)
+                if oChannel and (Status == 0):
+                    self.myDebug("onConnect for telnet " + str(oChannel.iIndex) + " called")
+                    oChannel.sConnectionStep = "connected"
+                    self.handleFifo(oChannel)
+                elif oChannel:
+                    self.resetChannel(oChannel, "failed: " + str(Description), time.time())
 
     def onMessage(self, Connection, Data):
         Domoticz.Debug("onMessage called")
@@ -795,29 +1621,54 @@ class BasePlugin:
             if (Connection == self.jsonConn):       
                 sData = Data["Data"].decode("utf-8", "ignore")
                 Status = int(Data["Status"])
+                dRequest = self.dJsonCurrentRequest
+                self.dJsonCurrentRequest = None
 
-                if (Status == 200):
+                if dRequest is None:
+                    Domoticz.Error("ebusd JSON HTTP interface sent unexpected data")
+                elif (Status == 200):
                     self.myDebug("Good Response received from ebusd : length " + str(len(sData)))
                     #self.jsonConn.Disconnect()
                     # now parse
-                    self.parseJson(sData)
+                    if dRequest["request"] == "find":
+                        self.parseJson(sData, dRequest)
+                    elif dRequest["request"] == "circuits":
+                        self.parseJsonCircuits(sData)
+                    else:
+                        self.parseJsonData(sData, dRequest)
                 else:
                     Domoticz.Error("ebusd JSON HTTP interface returned a status: " + str(Status))
+                    self.abortJsonRequest(dRequest)
+                # send next request
+                self.handleJsonFifo()
+            # telnet listen mode, data is line oriented
+            elif (Connection == self.listenConn):
+                self.parseListen(Data)
             # telnet answer, buffer may be incomplete, we wait for \n\n to be sure to get complete response, buffer completion is not handled by domoticz line protocol
             else:
-                sData = Data.decode("utf-8", "ignore")
-                # self.myDebug("Received data size " + str(len(sData)) + ": '"+sData+"'")
-                # we limit buffer size to keep memory, telnet answer shouldn't be big, as used by the plugin
-                if len(self.sBuffer) > 100000:
-                    self.sBuffer = ""
-                self.sBuffer += sData
-                # \n\n is the end of telnet response send by ebusd
-                if sData.endswith("\n\n"):
-                    # self.myDebug("Received buffer size " + str(len(self.sBuffer)) + ": '"+self.sBuffer+"'")
+                oChannel = self.getChannelByConnection(Connection)
+                if oChannel is None:
+                    return
+                oChannel.baBuffer += Data
+                # \n\n is the end of telnet response send by ebusd, many responses can be received at once when commands are pipelined
+                lResponses, oChannel.iScanPos = splitFrames(oChannel.baBuffer, oChannel.iScanPos, b"\n\n")
+                for sResponse in lResponses:
+                    # self.myDebug("Received buffer size " + str(len(sResponse)) + ": '"+sResponse+"'")
                     # now parse
-                    self.parseTelnet(self.sBuffer)
-                    # empty buffer
-                    self.sBuffer = ""
+                    self.parseTelnet(oChannel, sResponse)
+                    # connection works again
+                    oChannel.iReconnectDelay = 0
+                # we limit buffer size to keep memory, telnet answer shouldn't be that big, as used by the plugin
+                if len(oChannel.baBuffer) > self.iMaxReceiveSize:
+                    # the rest of the answer would be given to next command, drop the connection and the command
+                    if len(oChannel.dqInFlight) > 0:
+                        oChannel.dqInFlight[0]["retries"] = self.iMaxCommandRetries + 1
+                    self.resetChannel(oChannel, "received an answer exceeding " + str(self.iMaxReceiveSize) + " bytes", time.time())
+                    return
+                # Data received, room in the pipeline
+                oChannel.sConnectionStep = "connected"
+                # Handle fifo if there are still command to proceed
+                self.handleFifo(oChannel)
 
     def onCommand(self, DeviceID, Unit, Command, Level, Hue):
         Domoticz.Debug("onCommand called for device " + str(DeviceID) + " unit " + str(Unit) + ": Parameter '" + str(Command) + "', Level: " + str(Level) + ", Hue: " + str(Hue))
@@ -834,21 +1685,364 @@ class BasePlugin:
             if ((Devices[DeviceID].Units[Unit].Type == 0xF3) and (Devices[DeviceID].Units[Unit].SubType == 0x13)) :
                 self.write(DeviceID, Unit, "udevice", Devices[DeviceID].Units[Unit].nValue, Devices[DeviceID].Units[Unit].sValue)
             
+    def onDeviceAdded(self, DeviceID, Unit):
+        sIndexKey = DeviceID.casefold()
+        if (not sIndexKey in self.dDeviceIDIndex) or (Unit < self.dDeviceIDIndex[sIndexKey][1]):
+            self.dDeviceIDIndex[sIndexKey] = (DeviceID, Unit)
+
+    def onDeviceRemoved(self, DeviceID, Unit):
+        sIndexKey = DeviceID.casefold()
+        if self.dDeviceIDIndex.get(sIndexKey) == (DeviceID, Unit):
+            del self.dDeviceIDIndex[sIndexKey]
+            # another unit of the device may remain
+            if (DeviceID in Devices):
+                for iIndexUnit in Devices[DeviceID].Units:
+                    if iIndexUnit != Unit:
+                        self.onDeviceAdded(DeviceID, iIndexUnit)
+
     def onNotification(self, Name, Subject, Text, Status, Priority, Sound, ImageFile):
         Domoticz.Debug("onNotification called: " + Name + "," + Subject + "," + Text + "," + Status + "," + str(Priority) + "," + Sound + "," + ImageFile)
 
     def onDisconnect(self, Connection):
         Domoticz.Debug("onDisconnect called")
+        # if started and not stopping
+        if self.bIsStarted:
+            oChannel = self.getChannelByConnection(Connection)
+            # telnet connection closed by ebusd or lost, commands in flight won't be answered
+            if oChannel:
+                self.resetChannel(oChannel, "lost", time.time())
+
+    # Add a unit to local dictionnaries, schedule its refresh and read it
+    #   sDeviceID: string: DeviceID of the device in Devices dict
+    #   iIndexUnit: integer: unit number in device
+    #   oRecord: UnitRecord: unit parameters
+    #   timeNow: integer: current time
+    #   bCached: boolean: True if unit is restored from schema cache and must be checked again during next JSON parse
+    def addUnit(self, sDeviceID, iIndexUnit, oRecord, timeNow, bCached=False):
+        sCircuit = oRecord.sCircuit
+        sMessage = oRecord.sMessage
+        oRecord.oDevice = Devices[sDeviceID].Units[iIndexUnit]
+        oRecord.sDeviceID = sDeviceID
+        oRecord.iUnit = iIndexUnit
+        oRecord.bCached = bCached
+        # identical option tables are shared between units
+        oRecord.dOptions = self.shareTable(oRecord.dOptions)
+        oRecord.dReverseOptions = self.shareTable(oRecord.dReverseOptions)
+        oRecord.dDomoticzOptions = self.shareTable(oRecord.dDomoticzOptions)
+        oRecord.fnToDomoticz = compileEbusdToDomoticz(oRecord)
+        oRecord.fnToEbusd = compileDomoticzToEbusd(oRecord)
+        oRecord.fDeadband = self.dParamDeadbands.get(oRecord.sFieldType, 0.0)
+        oPreviousRecord = self.dUnitsByDeviceID.get(sDeviceID)
+        bRestored = False
+        if (type(oPreviousRecord) is UnitRecord) and oPreviousRecord.bCached:
+            # unit restored from cache is confirmed, keep values already read
+            oRecord.sFieldsValues = oPreviousRecord.sFieldsValues
+            oRecord.iFieldsValuesTimestamp = oPreviousRecord.iFieldsValuesTimestamp
+            oRecord.iReadTimestamp = oPreviousRecord.iReadTimestamp
+            oRecord.iListenTimestamp = oPreviousRecord.iListenTimestamp
+            self.removeUnit(sDeviceID)
+            bRead = False
+        elif ((sCircuit, sMessage) in self.dSnapshotValues) and (not oRecord.bForceRefresh):
+            # values saved during last run, the message is read when its refresh time is reached, stale messages first
+            oRecord.sFieldsValues, oRecord.iFieldsValuesTimestamp = self.dSnapshotValues[(sCircuit, sMessage)]
+            oRecord.iReadTimestamp = 0
+            oRecord.iListenTimestamp = 0
+            bRead = False
+            bRestored = True
+        else:
+            # set fieldsvaluestimestamp for read then write timeout
+            oRecord.iFieldsValuesTimestamp = timeNow - (2 * self.iTimeoutConstant)
+            oRecord.iReadTimestamp = 0
+            oRecord.iListenTimestamp = 0
+            bRead = True
+        self.dUnitsByDeviceID[sDeviceID] = oRecord
+        if not sCircuit in self.dUnits3D:
+            self.dUnits3D[sCircuit] = {}
+        iRefreshRate, bAdaptive, iMaxAge, oRecord.iDebounce = self.getRegisterOptions(oRecord.lRegisterKeys)
+        if not sMessage in self.dUnits3D[sCircuit]:
+            self.dUnits3D[sCircuit][sMessage] = {}
+            self.dMessageStates[(sCircuit, sMessage)] = {"refreshrate": iRefreshRate, "adaptive": bAdaptive, "maxage": iMaxAge, "interval": iRefreshRate, "due": 0}
+            if bRestored:
+                self.scheduleRefresh(sCircuit, sMessage, oRecord.iFieldsValuesTimestamp + iRefreshRate)
+            # spread refreshes of messages over the period, to prevent bursts
+            else:
+                self.scheduleRefresh(sCircuit, sMessage, timeNow + (iRefreshRate * random.uniform(0.5, 1.5)))
+        else:
+            # fields of a message are read at once, the most demanding field gives the refresh rate
+            dMessageState = self.dMessageStates[(sCircuit, sMessage)]
+            dMessageState["adaptive"] = dMessageState["adaptive"] or bAdaptive
+            if (iMaxAge is not None) and ((dMessageState["maxage"] is None) or (iMaxAge < dMessageState["maxage"])):
+                dMessageState["maxage"] = iMaxAge
+            if iRefreshRate < dMessageState["refreshrate"]:
+                dMessageState["refreshrate"] = iRefreshRate
+                dMessageState["interval"] = iRefreshRate
+                if dMessageState["due"] > (timeNow + iRefreshRate):
+                    self.scheduleRefresh(sCircuit, sMessage, timeNow + iRefreshRate)
+        self.dUnits3D[sCircuit][sMessage][oRecord.iFieldIndex] = oRecord
+        # restored values may be old, leave time for a first read
+        self.scheduleTimeout(sDeviceID, max(oRecord.iFieldsValuesTimestamp, timeNow - (2 * self.iTimeoutConstant)) + (3 * self.getRefreshInterval(oRecord)))
+        # place a read command in the queue for each device to refresh its value asap
+        if bRead:
+            self.read(oRecord, PriorityFifo.PRIORITY_DISCOVERY)
+
+    # Give the shared copy of an option table, tables are never modified once a unit is added
+    #   dTable: dictionnary: option table of a unit
+    def shareTable(self, dTable):
+        return self.dSharedTables.setdefault(frozenset(dTable.items()), dTable)
+
+    # Build index of Devices dict by casefolded DeviceID, once per parse, then kept up to date by onDeviceAdded and onDeviceRemoved
+    def indexDevices(self):
+        self.dDeviceIDIndex = {}
+        for sDeviceID, oDevice in Devices.items():
+            for iIndexUnit in oDevice.Units:
+                self.onDeviceAdded(sDeviceID, iIndexUnit)
+
+    # Forget definition and units of a message, before the message is parsed again or because it doesn't exist anymore
+    #   sCircuit: string: circuit name
+    #   sMessage: string: message name
+    def forgetMessage(self, sCircuit, sMessage):
+        for sKey in self.dMessageKeys.pop((sCircuit, sMessage), []):
+            self.dMessages.pop(sKey, None)
+            # forget erroneous register too
+            if type(self.dUnitsByDeviceID.get(sKey)) is str:
+                del self.dUnitsByDeviceID[sKey]
+        for oRecord in list(self.dUnits3D.get(sCircuit, {}).get(sMessage, {}).values()):
+            # units restored from cache are checked by caller
+            if not oRecord.bCached:
+                self.myDebug("Definition of circuit " + sCircuit + " message " + sMessage + " changed, forget register " + oRecord.sDeviceID)
+                self.removeUnit(oRecord.sDeviceID)
+
+    # Remove a unit from local dictionnaries
+    #   sDeviceID: string: DeviceID of the device in Devices dict
+    def removeUnit(self, sDeviceID):
+        oRecord = self.dUnitsByDeviceID.pop(sDeviceID, None)
+        if type(oRecord) is UnitRecord:
+            sCircuit = oRecord.sCircuit
+            sMessage = oRecord.sMessage
+            dFields = self.dUnits3D.get(sCircuit, {}).get(sMessage, {})
+            if dFields.get(oRecord.iFieldIndex) is oRecord:
+                del dFields[oRecord.iFieldIndex]
+            # message state is forgotten at next due time
+            if (sMessage in self.dUnits3D.get(sCircuit, {})) and (len(dFields) == 0):
+                del self.dUnits3D[sCircuit][sMessage]
+
+    # Give signature of plugin parameters that have an effect on discovered units
+    def getParametersSignature(self):
+        return self.sParamAddress + ":" + str(self.iParamTelnetPort) + ":" + str(self.iParamJsonPort) + "|" + self.sParamRegisters + "|" + str(self.bParamReadOnly) + "|" + str(self.bParamAutoAdd)
+
+    # Save discovered units to schema cache file, to be able to start polling at next start without waiting for JSON data
+    def saveSchemaCache(self):
+        if not self.sSchemaCacheFile:
+            return
+        lUnits = []
+        for sDeviceID, oRecord in self.dUnitsByDeviceID.items():
+            if type(oRecord) is UnitRecord:
+                lUnits.append({"deviceid": sDeviceID, "unit": oRecord.iUnit, "circuit": oRecord.sCircuit, "message": oRecord.sMessage, "fieldindex": oRecord.iFieldIndex, "fieldscount": oRecord.iFieldsCount, "fieldtype": oRecord.sFieldType, "options": oRecord.dOptions, "reverseoptions": list(oRecord.dReverseOptions.items()), "domoticzoptions": oRecord.dDomoticzOptions, "alwaysrefresh": oRecord.bAlwaysRefresh, "registerkeys": oRecord.lRegisterKeys})
+        lSignatures = [[sCircuit, sMessage, sSignature] for (sCircuit, sMessage), sSignature in self.dDefinitionSignatures.items() if sMessage in self.dUnits3D.get(sCircuit, {})]
+        dCache = {"version": self.iSchemaCacheVersion, "parameters": self.getParametersSignature(), "ebusd": self.dEbusdSignature, "signatures": lSignatures, "units": lUnits}
+        try:
+            with open(self.sSchemaCacheFile, "w", encoding="utf-8") as oFile:
+                json.dump(dCache, oFile)
+            self.myDebug("Schema cache saved with " + str(len(lUnits)) + " units to " + self.sSchemaCacheFile)
+        except Exception as e:
+            Domoticz.Error("Cannot save schema cache to " + self.sSchemaCacheFile + ": " + str(e))
+
+    # Save last values of messages to snapshot file, to restore them at next start instead of reading all messages at once
+    def saveSnapshot(self):
+        if not self.sSnapshotFile:
+            return
+        timeNow = time.time()
+        self.iSnapshotTime = timeNow
+        # keep restored values of messages that may still be discovered
+        if timeNow < (self.iDiscoverStartTime + self.iDiscoverTime):
+            dValues = {tKey: tValues for tKey, tValues in self.dSnapshotValues.items() if not tKey[1] in self.dUnits3D.get(tKey[0], {})}
+        else:
+            dValues = {}
+        for sCircuit, dMessages in self.dUnits3D.items():
+            for sMessage, dFields in dMessages.items():
+                oRecord = next(iter(dFields.values()), None)
+                if oRecord and (oRecord.sFieldsValues is not None):
+                    dValues[(sCircuit, sMessage)] = (oRecord.sFieldsValues, oRecord.iFieldsValuesTimestamp)
+        dSnapshot = {"version": self.iSnapshotVersion, "messages": [[sCircuit, sMessage, sFieldsValues, iTimestamp] for (sCircuit, sMessage), (sFieldsValues, iTimestamp) in dValues.items()]}
+        try:
+            with open(self.sSnapshotFile, "w", encoding="utf-8") as oFile:
+                json.dump(dSnapshot, oFile)
+            self.myDebug("Values snapshot saved with " + str(len(dValues)) + " messages to " + self.sSnapshotFile)
+        except Exception as e:
+            Domoticz.Error("Cannot save values snapshot to " + self.sSnapshotFile + ": " + str(e))
+
+    # Load last values of messages from snapshot file, they are given to units when they are added
+    def loadSnapshot(self):
+        if not self.sSnapshotFile:
+            return
+        try:
+            with open(self.sSnapshotFile, "r", encoding="utf-8") as oFile:
+                dSnapshot = json.load(oFile)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            Domoticz.Error("Cannot read values snapshot from " + self.sSnapshotFile + ": " + str(e))
+            return
+        if dSnapshot.get("version") != self.iSnapshotVersion:
+            self.myDebug("Values snapshot ignored because its format changed")
+            return
+        self.dSnapshotValues = {(sCircuit, sMessage): (sFieldsValues, iTimestamp) for sCircuit, sMessage, sFieldsValues, iTimestamp in dSnapshot.get("messages", [])}
+        self.iSnapshotTime = time.time()
+        Domoticz.Status("Restored values of " + str(len(self.dSnapshotValues)) + " messages from snapshot")
+
+    # Restore units from schema cache file, they will be checked again during next JSON parse
+    def loadSchemaCache(self):
+        if not self.sSchemaCacheFile:
+            return
+        try:
+            with open(self.sSchemaCacheFile, "r", encoding="utf-8") as oFile:
+                dCache = json.load(oFile)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            Domoticz.Error("Cannot read schema cache from " + self.sSchemaCacheFile + ": " + str(e))
+            return
+        if dCache.get("version") != self.iSchemaCacheVersion:
+            self.myDebug("Schema cache ignored because its format changed")
+            return
+        if dCache.get("parameters") != self.getParametersSignature():
+            self.myDebug("Schema cache ignored because parameters changed")
+            return
+        timeNow = time.time()
+        iCount = 0
+        for dCachedUnit in dCache.get("units", []):
+            sDeviceID = dCachedUnit["deviceid"]
+            iIndexUnit = dCachedUnit["unit"]
+            if (sDeviceID in Devices) and (iIndexUnit in Devices[sDeviceID].Units):
+                # JSON keys are strings, levels are integers
+                dReverseOptions = {int(iLevel): sValue for iLevel, sValue in dCachedUnit["reverseoptions"]}
+                oRecord = UnitRecord(dCachedUnit["circuit"], dCachedUnit["message"], dCachedUnit["fieldindex"], dCachedUnit["fieldscount"], dCachedUnit["options"], dReverseOptions, dCachedUnit["domoticzoptions"], dCachedUnit["fieldtype"], False, dCachedUnit["alwaysrefresh"], dCachedUnit["registerkeys"])
+                self.addUnit(sDeviceID, iIndexUnit, oRecord, timeNow, True)
+                iCount += 1
+        self.dDefinitionSignatures = {(sCircuit, sMessage): sSignature for sCircuit, sMessage, sSignature in dCache.get("signatures", [])}
+        Domoticz.Status("Restored " + str(iCount) + " registers from schema cache, ebusd version " + str(dCache.get("ebusd", {}).get("version")) + " with " + str(dCache.get("ebusd", {}).get("messages")) + " messages")
+
+    # Set next refresh time of a message
+    #   sCircuit: string: circuit name
+    #   sMessage: string: message name
+    #   iDueTime: integer: time when message shall be read
+    def scheduleRefresh(self, sCircuit, sMessage, iDueTime):
+        self.dMessageStates[(sCircuit, sMessage)]["due"] = iDueTime
+        heapq.heappush(self.lRefreshHeap, (iDueTime, sCircuit, sMessage))
+
+    # Set time after which a unit is timed out if not refreshed
+    #   sDeviceID: string: DeviceID of the device in Devices dict
+    #   iDeadline: integer: timeout time
+    def scheduleTimeout(self, sDeviceID, iDeadline):
+        self.dTimeoutDeadlines[sDeviceID] = iDeadline
+        heapq.heappush(self.lTimeoutHeap, (iDeadline, sDeviceID))
+
+    # Time out devices whose deadline is passed, only heap entries whose deadline is reached are looked at
+    #   timeNow: integer: current time
+    def checkTimeouts(self, timeNow):
+        while (len(self.lTimeoutHeap) > 0) and (self.lTimeoutHeap[0][0] < timeNow):
+            iDeadline, sDeviceID = heapq.heappop(self.lTimeoutHeap)
+            # obsolete entry, unit has been rescheduled
+            if self.dTimeoutDeadlines.get(sDeviceID) != iDeadline:
+                continue
+            del self.dTimeoutDeadlines[sDeviceID]
+            if (not sDeviceID in Devices) or Devices[sDeviceID].TimedOut:
+                continue
+            oRecord = self.dUnitsByDeviceID.get(sDeviceID)
+            if type(oRecord) is UnitRecord:
+                # deadline may have moved since entry was pushed, values refreshed or refresh interval adapted
+                iDeadline = oRecord.iFieldsValuesTimestamp + (3 * self.getRefreshInterval(oRecord))
+                if iDeadline >= timeNow:
+                    self.scheduleTimeout(sDeviceID, iDeadline)
+                elif oRecord.sCircuit in self.dCircuitBreakers:
+                    Domoticz.Error("DeviceID " + sDeviceID + " not refreshed since a long time because circuit " + oRecord.sCircuit + " doesn't answer, timed out")
+                    Devices[sDeviceID].TimedOut=1
+                else:
+                    Domoticz.Error("DeviceID " + sDeviceID + " not refreshed since a long time and timed out")
+                    Devices[sDeviceID].TimedOut=1
+            # unit removed since, wait for end of discovering before deciding it is not detected anymore
+            elif timeNow < (self.iDiscoverStartTime + self.iDiscoverTime):
+                self.scheduleTimeout(sDeviceID, self.iDiscoverStartTime + self.iDiscoverTime)
+            else:
+                Domoticz.Error("DeviceID " + sDeviceID + " not detected and timed out")
+                Devices[sDeviceID].TimedOut=1
+
+    # Give current refresh interval of the message of a unit
+    #   oRecord: UnitRecord
+    def getRefreshInterval(self, oRecord):
+        return self.dMessageStates[(oRecord.sCircuit, oRecord.sMessage)]["interval"]
+
+    # Give max age in s of cached values of the message of a unit, 0 if cache is disabled, None to let ebusd decide
+    #   oRecord: UnitRecord
+    def getMaxAge(self, oRecord):
+        if self.bParamDisableCache:
+            return 0
+        return self.dMessageStates[(oRecord.sCircuit, oRecord.sMessage)]["maxage"]
+
+    # Tell if fields values of the message of a unit, from last read or listen, are recent enough to be used without reading again
+    #   oRecord: UnitRecord
+    #   timeNow: integer: current time
+    def isCacheFresh(self, oRecord, timeNow):
+        iMaxAge = self.getMaxAge(oRecord)
+        return (iMaxAge is not None) and (oRecord.sFieldsValues is not None) and ((oRecord.iFieldsValuesTimestamp + iMaxAge) >= timeNow)
+
+    # Adapt refresh interval of a message to observed changes, if adaptive mode is enabled
+    #   sCircuit: string: circuit name
+    #   sMessage: string: message name
+    #   bChanged: boolean: True if values of the message changed since last time
+    #   timeNow: integer: current time
+    def adaptRefreshInterval(self, sCircuit, sMessage, bChanged, timeNow):
+        dMessageState = self.dMessageStates[(sCircuit, sMessage)]
+        if not dMessageState["adaptive"]:
+            return
+        if bChanged:
+            dMessageState["interval"] = max(dMessageState["refreshrate"] * self.fAdaptiveMinRatio, dMessageState["interval"] * self.fAdaptiveDecrease)
+            # read sooner if the message was planned later than the new interval
+            if dMessageState["due"] > (timeNow + dMessageState["interval"]):
+                self.scheduleRefresh(sCircuit, sMessage, timeNow + dMessageState["interval"])
+        else:
+            dMessageState["interval"] = min(dMessageState["refreshrate"] * self.fAdaptiveMaxRatio, dMessageState["interval"] * self.fAdaptiveIncrease)
+        self.myDebug("Refresh interval of circuit " + sCircuit + " message " + sMessage + " is now " + str(round(dMessageState["interval"])) + " s")
+
+    # Give first unit of each message whose refresh time is reached, and schedule their next refresh
+    #   timeNow: integer: current time
+    def getDueUnits(self, timeNow):
+        lUnits = []
+        while (len(self.lRefreshHeap) > 0) and (self.lRefreshHeap[0][0] <= timeNow):
+            iDueTime, sCircuit, sMessage = heapq.heappop(self.lRefreshHeap)
+            dMessageState = self.dMessageStates.get((sCircuit, sMessage))
+            # obsolete entry, message has been rescheduled or removed
+            if (not dMessageState) or (dMessageState["due"] != iDueTime):
+                continue
+            if (not sCircuit in self.dUnits3D) or (not sMessage in self.dUnits3D[sCircuit]):
+                del self.dMessageStates[(sCircuit, sMessage)]
+                continue
+            # keep the spread of messages over the period, unless we are late by more than a period
+            iNextDueTime = iDueTime + dMessageState["interval"]
+            if iNextDueTime <= timeNow:
+                iNextDueTime = timeNow + dMessageState["interval"]
+            self.scheduleRefresh(sCircuit, sMessage, iNextDueTime)
+            # only refresh first found field, read operation will read all declared fields anyway
+            oRecord = next(iter(self.dUnits3D[sCircuit][sMessage].values()), None)
+            if oRecord:
+                lUnits.append(oRecord)
+        return lUnits
 
     # Add a read command to the queue
-    #   dUnit: dict
-    def read(self, dUnit):
-        if type(dUnit) is dict:
-            self.myDebug("read called for circuit " + dUnit["circuit"] + " message " + dUnit["message"] + " field " + str(dUnit["fieldindex"]))
-            self.dqFifo.append({"operation":"read", "unit":dUnit})
-            self.handleFifo()
+    #   oRecord: UnitRecord
+    #   iPriority: integer: priority class, see PriorityFifo
+    #   bFresh: boolean: True if value must not be older than refresh interval, even if ebusd cache allows it
+    def read(self, oRecord, iPriority=PriorityFifo.PRIORITY_REFRESH, bFresh=False):
+        if type(oRecord) is UnitRecord:
+            self.myDebug("read called for circuit " + oRecord.sCircuit + " message " + oRecord.sMessage + " field " + str(oRecord.iFieldIndex))
+            oChannel = self.getChannel(oRecord.sCircuit)
+            dCommand = {"operation":"read", "unit":oRecord}
+            if bFresh:
+                dCommand["fresh"] = True
+            oChannel.dqFifo.append(dCommand, iPriority)
+            self.handleFifo(oChannel)
         else:
-            Domoticz.Error("Cannot read device that is in error state: " + dUnit)
+            Domoticz.Error("Cannot read device that is in error state: " + oRecord)
     
     # Will write a value to ebusd
     #   sDeviceID: string: device in Devices dict
@@ -859,147 +2053,272 @@ class BasePlugin:
             Domoticz.Debug("Cannot write device " + str(sDeviceID) + " because the read-only parameter is set")
             return
         elif sDeviceID in self.dUnitsByDeviceID:
-            dUnit = self.dUnitsByDeviceID[sDeviceID]
+            oRecord = self.dUnitsByDeviceID[sDeviceID]
             # convert domoticz command and level to ebusd string value
-            sValue = valueDomoticzToEbusd(dUnit, sCommand, ifValue, sValue, Devices[sDeviceID].Units[iUnitNumber].nValue, Devices[sDeviceID].Units[iUnitNumber].sValue)
-                    
-            # if there are more than one field, we must read all fields, modify the required field and write back all fields at once
-            iFieldsCount = dUnit["fieldscount"]
-            if iFieldsCount <= 1:
-                self.myDebug("Will write " + sValue)
-                self.dqFifo.append({"operation":"write", "unit":dUnit, "value":sValue})
-                # write then read to update Domoticz interface
-                self.dqFifo.append({"operation":"read", "unit":dUnit})
-                # launch commands in the queue
-                self.handleFifo()
+            sValue = oRecord.fnToEbusd(sCommand, ifValue, sValue, Devices[sDeviceID].Units[iUnitNumber].nValue)
+            if oRecord.iDebounce > 0:
+                # keep only latest value of each field until the end of debounce time, fields of a message are written at once
+                timeNow = time.time()
+                dPendingWrite = self.dPendingWrites.setdefault((oRecord.sCircuit, oRecord.sMessage), {"unit": oRecord, "fields": {}, "due": timeNow + oRecord.iDebounce})
+                dPendingWrite["fields"][oRecord.iFieldIndex] = sValue
+                dPendingWrite["due"] = min(dPendingWrite["due"], timeNow + oRecord.iDebounce)
+                self.myDebug("Will write " + sValue + " in " + str(round(dPendingWrite["due"] - timeNow)) + " s")
+                # check pending writes every second
+                Domoticz.Heartbeat(1)
             else:
-                self.myDebug("Will write (more than one field) " + sValue)
-                # read all fields first before write one field when more than one field in the message
-                self.dqFifo.append({"operation":"read", "unit":dUnit})
-                self.dqFifo.append({"operation":"write", "unit":dUnit, "value":sValue})
-                # write then read to update Domoticz interface
-                self.dqFifo.append({"operation":"read", "unit":dUnit})
-                # launch commands in the queue
-                self.handleFifo()
+                self.queueWrite(oRecord, {oRecord.iFieldIndex: sValue})
         else:
             Domoticz.Error("Cannot write device " + str(sDeviceID) + " that doesn't exist")
 
-    # Handle the connection to Telnet port and the command queue
-    def handleFifo(self):
-        Domoticz.Debug("handleFifo() called")
+    # Queue pending writes whose debounce time is over
+    #   timeNow: integer: current time
+    def flushWrites(self, timeNow):
+        bFlushed = False
+        for tKey, dPendingWrite in list(self.dPendingWrites.items()):
+            if dPendingWrite["due"] <= timeNow:
+                del self.dPendingWrites[tKey]
+                self.queueWrite(dPendingWrite["unit"], dPendingWrite["fields"])
+                bFlushed = True
+        # back to normal heartbeat once all writes are queued
+        if bFlushed and (len(self.dPendingWrites) == 0):
+            Domoticz.Heartbeat(self.iHeartbeatInterval)
+
+    # Queue write of fields of a message, then read to update Domoticz interface
+    #   oRecord: UnitRecord: unit written
+    #   dFieldsValues: dictionnary of strings keyed by field index: values to write in ebusd format
+    def queueWrite(self, oRecord, dFieldsValues):
+        oChannel = self.getChannel(oRecord.sCircuit)
+        # if there are more than one field, we must read all fields, modify the required field and write back all fields at once
+        iFieldsCount = oRecord.iFieldsCount
+        if iFieldsCount <= 1:
+            sValue = dFieldsValues[oRecord.iFieldIndex]
+            self.myDebug("Will write " + sValue)
+            oChannel.dqFifo.append({"operation":"write", "unit":oRecord, "value":sValue}, PriorityFifo.PRIORITY_WRITE)
+        else:
+            self.myDebug("Will write (more than one field) " + str(dFieldsValues))
+            if list(dFieldsValues) == [oRecord.iFieldIndex]:
+                dCommand = {"operation":"write", "unit":oRecord, "value":dFieldsValues[oRecord.iFieldIndex]}
+            else:
+                dCommand = {"operation":"write", "unit":oRecord, "fields":dFieldsValues}
+            # read all fields first before write one field when more than one field in the message, unless values are recent enough
+            if self.isCacheFresh(oRecord, time.time()):
+                self.myDebug("Cached fields values are recent enough, no read before write")
+                # decided once, values aren't checked again when write is sent
+                dCommand["validated"] = True
+            else:
+                oChannel.dqFifo.append({"operation":"read", "unit":oRecord}, PriorityFifo.PRIORITY_WRITE)
+            oChannel.dqFifo.append(dCommand, PriorityFifo.PRIORITY_WRITE)
+        # write then read to update Domoticz interface
+        oChannel.dqFifo.append({"operation":"read", "unit":oRecord}, PriorityFifo.PRIORITY_READAFTERWRITE)
+        # launch commands in the queue
+        self.handleFifo(oChannel)
+
+    # Handle the connection to Telnet port and the command queue of a channel
+    #   oChannel: TelnetChannel: channel to handle
+    def handleFifo(self, oChannel):
+        Domoticz.Debug("handleFifo() called for connection " + str(oChannel.iIndex))
         timeNow = time.time()
-        # init of self.iConnectionTimestamp
-        if self.iConnectionTimestamp == 0 :
-            self.iConnectionTimestamp = timeNow
-        # telnet connection not connected yet or no data processing
-        if ((self.sConnectionStep == "idle") or (self.sConnectionStep == "connected")) and (len(self.dqFifo) > 0):
-            # record time
-            self.iConnectionTimestamp = timeNow
+        # init of oChannel.iConnectionTimestamp
+        if oChannel.iConnectionTimestamp == 0 :
+            oChannel.iConnectionTimestamp = timeNow
+        # telnet connection not connected yet or room in the pipeline
+        if ((oChannel.sConnectionStep == "idle") or (oChannel.sConnectionStep == "connected")) and (len(oChannel.dqFifo) > 0):
             # create connection
-            if self.telnetConn == None:
+            if oChannel.telnetConn == None:
                 self.myDebug("handleFifo() create connection to " + self.sParamAddress + ":" + str(self.iParamTelnetPort))
-                self.telnetConn = Domoticz.Connection(Name="Telnet", Transport="TCP/IP", Protocol="", Address=self.sParamAddress, Port=str(self.iParamTelnetPort))
-            if not self.telnetConn.Connected():
+                oChannel.telnetConn = Domoticz.Connection(Name="Telnet " + str(oChannel.iIndex), Transport="TCP/IP", Protocol="", Address=self.sParamAddress, Port=str(self.iParamTelnetPort))
+            if not oChannel.telnetConn.Connected():
+                # wait for backoff delay after a failure, heartbeat will try again
+                if timeNow < oChannel.iReconnectTime:
+                    return
+                # record time
+                oChannel.iConnectionTimestamp = timeNow
                 self.myDebug("Connect")
-                self.sConnectionStep = "connecting"
-                self.telnetConn.Connect()
+                oChannel.sConnectionStep = "connecting"
+                oChannel.dqInFlight.clear()
+                oChannel.telnetConn.Connect()
             # or process queue
             else:
                 self.myDebug("Handle")
-                # pop command from queue (first in first out)
-                # pop command from queue (first in first out)
-                sCommand = self.dqFifo.popleft()
-                dUnit = sCommand["unit"]
-                self.sConnectionStep = "data sending"
-                if type(dUnit) is dict:
-                    self.sCurrentCommand = sCommand["operation"]
-                    # read command
-                    if self.sCurrentCommand == "read":
-                        #self.telnetConn.Send("read -c " + dUnit["circuit"] + " " + dUnit["message"] + "\r\n")
-                        #self.telnetConn.Send("read -c " + dUnit["circuit"] + " " + dUnit["message"] + " " + dUnit["fieldname"] + "." + str(dUnit["fieldindex"]) + "\r\n")
-                        # telnet read command in verbose mode
-                        sRead = "read "
-                        # if no cache
-                        if self.bParamDisableCache :
-                            sRead = sRead + "-f "
-                        sRead = sRead + " -v -c " + dUnit["circuit"] + " " + dUnit["message"] + "\r\n"
-                        self.myDebug("Telnet write: " + sRead)
-                        self.telnetConn.Send(sRead)
-                    # write command
-                    elif self.sCurrentCommand == "write" and (not self.bParamReadOnly):
-                        iFieldsCount = dUnit["fieldscount"]
-                        # we have more than one field, retrieve all fields value (from last read) if not too old, modify the field and write
-                        if iFieldsCount > 1:
-                            if ((dUnit["fieldsvaluestimestamp"] + self.iTimeoutConstant) >= timeNow):
-                                # fields in a string are separated by ;
-                                lData = dUnit["fieldsvalues"].split(";")
-                                # sanity check
-                                if len(lData) != iFieldsCount: 
-                                    Domoticz.Error("Field count is not " + str(iFieldsCount) + " as expected")
-                                else:
-                                    # modify register
-                                    lData[dUnit["fieldindex"]] = sCommand["value"]
-                                    # rebuild the fields for the message, in a string, with ; as separator
-                                    sData = ";".join(lData)
-                                    # telnet write command
-                                    sWrite = "write -c " + dUnit["circuit"] + " " + dUnit["message"] + " " + sData + "\r\n"
-                                    self.myDebug("Telnet write: " + sWrite)
-                                    self.telnetConn.Send(sWrite)
-                            else:
-                                Domoticz.Error("Data cached is too old or inexistent, won't take the risk to modify many fields at once")
+                while (len(oChannel.dqFifo) > 0) and (len(oChannel.dqInFlight) < self.iParamPipeline):
+                    dNextCommand = oChannel.dqFifo.peek()
+                    oRecord = dNextCommand["unit"]
+                    # writing many fields at once needs values from previous read, wait for all answers before sending
+                    if (dNextCommand["operation"] == "write") and (type(oRecord) is UnitRecord) and (oRecord.iFieldsCount > 1) and (len(oChannel.dqInFlight) > 0):
+                        break
+                    # pop command from queue (first in first out)
+                    sCommand = oChannel.dqFifo.popleft()
+                    sSend = self.buildCommand(sCommand, timeNow)
+                    if sSend:
+                        # record time
+                        oChannel.iConnectionTimestamp = timeNow
+                        self.myDebug("Telnet write: " + sSend)
+                        sCommand["sendtimestamp"] = timeNow
+                        oChannel.dqInFlight.append(sCommand)
+                        oChannel.telnetConn.Send(sSend)
+                # wait for answers before sending remaining commands
+                if (len(oChannel.dqFifo) > 0) or (len(oChannel.dqInFlight) >= self.iParamPipeline):
+                    oChannel.sConnectionStep = "data sending"
+
+    # Detect a telnet connection blocked in connecting step or a command without answer, then send queued commands
+    #   oChannel: TelnetChannel: channel to check
+    #   timeNow: integer: current time
+    def checkChannel(self, oChannel, timeNow):
+        if (oChannel.sConnectionStep == "connecting") and (timeNow >= (oChannel.iConnectionTimestamp + self.iTimeoutConstant)):
+            self.resetChannel(oChannel, "timed out while connecting", timeNow)
+        elif (len(oChannel.dqInFlight) > 0) and (timeNow >= (oChannel.dqInFlight[0]["sendtimestamp"] + self.iTimeoutConstant)):
+            # ebusd answers in sending order, a late answer would be given to the wrong command, so the connection is dropped
+            dCommand = oChannel.dqInFlight[0]
+            dCommand["retries"] = dCommand.get("retries", 0) + 1
+            self.resetChannel(oChannel, "timed out waiting for an answer", timeNow)
+        elif (oChannel.sConnectionStep == "data sending") and (len(oChannel.dqInFlight) == 0):
+            oChannel.sConnectionStep = "connected"
+        self.handleFifo(oChannel)
+
+    # Drop telnet connection of a channel after a failure, queue again commands in flight, and delay next connection with exponential backoff
+    # discovered units and queued commands are kept
+    #   oChannel: TelnetChannel: channel to reset
+    #   sReason: string: failure, for logs
+    #   timeNow: integer: current time
+    def resetChannel(self, oChannel, sReason, timeNow):
+        Domoticz.Error("Telnet connection " + str(oChannel.iIndex) + " " + sReason + ", reconnect in " + str(oChannel.iReconnectDelay) + " s")
+        # put back commands in flight in sending order, the first one may have been sent too many times
+        while len(oChannel.dqInFlight) > 0:
+            dCommand = oChannel.dqInFlight.pop()
+            if dCommand.get("retries", 0) > self.iMaxCommandRetries:
+                oRecord = dCommand["unit"]
+                if type(oRecord) is UnitRecord:
+                    Domoticz.Error("Command " + dCommand["operation"] + " on circuit " + oRecord.sCircuit + " message " + oRecord.sMessage + " dropped after " + str(dCommand["retries"]) + " attempts")
+            elif not oChannel.dqFifo.requeue(dCommand):
+                self.myDebug("Command " + dCommand["operation"] + " not queued again, a similar command is pending")
+        # a new connection object is created at next attempt, late events of the old one are ignored
+        if (oChannel.telnetConn != None) and (oChannel.telnetConn.Connected() or oChannel.telnetConn.Connecting()):
+            oChannel.telnetConn.Disconnect()
+        oChannel.telnetConn = None
+        oChannel.baBuffer.clear()
+        oChannel.iScanPos = 0
+        oChannel.sConnectionStep = "idle"
+        oChannel.iReconnectTime = timeNow + oChannel.iReconnectDelay
+        oChannel.iReconnectDelay = min(self.iReconnectMaxDelay, max(self.iReconnectMinDelay, oChannel.iReconnectDelay * 2))
+
+    # Build telnet command string for a command from the queue, return empty string if nothing can be sent
+    #   sCommand: dictionnary: command from dqFifo
+    #   timeNow: integer: current time
+    def buildCommand(self, sCommand, timeNow):
+        oRecord = sCommand["unit"]
+        if (type(oRecord) is UnitRecord) and not (oRecord.sMessage in self.dUnits3D.get(oRecord.sCircuit, {})):
+            self.myDebug("Command ignored for circuit " + oRecord.sCircuit + " message " + oRecord.sMessage + " not anymore in dictionnary")
+        elif type(oRecord) is UnitRecord:
+            sOperation = sCommand["operation"]
+            # reads of a circuit that doesn't answer are skipped, except probes, reads for writes are always sent
+            if (sOperation == "read") and (sCommand["priority"] >= PriorityFifo.PRIORITY_DISCOVERY) and not self.isCircuitReadable(oRecord.sCircuit, oRecord.sMessage, timeNow):
+                self.myDebug("Read skipped for circuit " + oRecord.sCircuit + " message " + oRecord.sMessage + " that doesn't answer")
+            # read command
+            elif sOperation == "read":
+                #self.telnetConn.Send("read -c " + oRecord.sCircuit + " " + oRecord.sMessage + "\r\n")
+                #self.telnetConn.Send("read -c " + oRecord.sCircuit + " " + oRecord.sMessage + " " + oRecord.sFieldName + "." + str(oRecord.iFieldIndex) + "\r\n")
+                # telnet read command in verbose mode
+                sRead = "read "
+                # if no cache
+                iMaxAge = self.getMaxAge(oRecord)
+                # value not found recent enough in ebusd cache by a bulk read, ebusd mustn't answer it again
+                if sCommand.get("fresh"):
+                    iInterval = int(self.getRefreshInterval(oRecord))
+                    iMaxAge = iInterval if iMaxAge is None else min(iMaxAge, iInterval)
+                if iMaxAge == 0 :
+                    sRead = sRead + "-f "
+                # value from ebusd cache only if not too old
+                elif iMaxAge is not None:
+                    sRead = sRead + "-m " + str(iMaxAge) + " "
+                sRead = sRead + " -v -c " + oRecord.sCircuit + " " + oRecord.sMessage + "\r\n"
+                for oMessageRecord in self.dUnits3D[oRecord.sCircuit][oRecord.sMessage].values():
+                    oMessageRecord.iReadTimestamp = timeNow
+                return sRead
+            # write command
+            elif sOperation == "write" and (not self.bParamReadOnly):
+                iFieldsCount = oRecord.iFieldsCount
+                # we have more than one field, retrieve all fields value (from read before write, or found recent enough when write has been queued), modify the field and write
+                if iFieldsCount > 1:
+                    if (oRecord.sFieldsValues is not None) and (sCommand.get("validated") or ((oRecord.iFieldsValuesTimestamp + self.iTimeoutConstant) >= timeNow)):
+                        # fields in a string are separated by ;
+                        lData = oRecord.sFieldsValues.split(";")
+                        # sanity check
+                        if len(lData) != iFieldsCount: 
+                            Domoticz.Error("Field count is not " + str(iFieldsCount) + " as expected")
                         else:
-                            # telnet write command if only one field in message
-                            sWrite = "write -c " + dUnit["circuit"] + " " + dUnit["message"] + " " + sCommand["value"] + "\r\n"
-                            self.myDebug("Telnet write: " + sWrite)
-                            self.telnetConn.Send(sWrite)
-                    # Ignore username and password, I'm not sure when I should authenticate and it can be handled by ACL file directly by ebusd
-                    #elif self.sCurrentCommand == "authenticate":
-                            #sWrite = "auth " + Parameters["Username"] + " " + Parameters["Password"] + "\r\n"
-                            #self.myDebug("Telnet write:" + sWrite)
+                            # modify registers
+                            for iFieldIndex, sFieldValue in sCommand.get("fields", {oRecord.iFieldIndex: sCommand.get("value")}).items():
+                                lData[iFieldIndex] = sFieldValue
+                            # rebuild the fields for the message, in a string, with ; as separator
+                            sData = ";".join(lData)
+                            # keep written values, so that a following write of another field of the message doesn't restore the old value
+                            for oMessageRecord in self.dUnits3D[oRecord.sCircuit][oRecord.sMessage].values():
+                                oMessageRecord.sFieldsValues = sData
+                            # telnet write command
+                            return "write -c " + oRecord.sCircuit + " " + oRecord.sMessage + " " + sData + "\r\n"
+                    else:
+                        Domoticz.Error("Data cached is too old or inexistent, won't take the risk to modify many fields at once")
                 else:
-                    Domoticz.Error("Received command for unit in error state: " + dUnit)
-        # the plugin seems blocked in connecting or data sending step, restart the plugin
-        elif (len(self.dqFifo) > 0) and (timeNow >= (self.iConnectionTimestamp + self.iTimeoutConstant)) :
-            Domoticz.Error("Timeout during handleFifo, ask to restart plugin")
-            self.bShallRestart = True
-            return
+                    # telnet write command if only one field in message
+                    return "write -c " + oRecord.sCircuit + " " + oRecord.sMessage + " " + sCommand["value"] + "\r\n"
+            # Ignore username and password, I'm not sure when I should authenticate and it can be handled by ACL file directly by ebusd
+            #elif sOperation == "authenticate":
+                    #sWrite = "auth " + Parameters["Username"] + " " + Parameters["Password"] + "\r\n"
+                    #self.myDebug("Telnet write:" + sWrite)
+        else:
+            Domoticz.Error("Received command for unit in error state: " + oRecord)
+        return ""
         
     def onHeartbeat(self):
         Domoticz.Debug("onHeartbeat() called")
         # if started and not stopping
         if self.bIsStarted:
-            # restart pending ?
-            if self.bShallRestart:
-                self.onStop()
-                self.onStart()
+            timeNow = time.time()
+            # queue writes whose debounce time is over
+            if len(self.dPendingWrites) > 0:
+                self.flushWrites(timeNow)
+            # refresh values of already detected registers whose refresh time is reached
+            lUnitsToRefresh = []
+            for oRecord in self.getDueUnits(timeNow):
+                # in listen mode, poll only messages that haven't been seen on the bus during last period
+                if self.bParamListen and ((oRecord.iListenTimestamp + self.getRefreshInterval(oRecord)) > timeNow):
+                    continue
+                lUnitsToRefresh.append(oRecord)
+            # get all values from ebusd cache at once, if cache is allowed
+            if self.bParamBulk and (not self.bParamDisableCache) and (len(lUnitsToRefresh) > 1):
+                self.readBulk(lUnitsToRefresh)
             else:
-                timeNow = time.time()
-                # refresh
-                if (timeNow >= (self.iRefreshTime + self.iParamRefreshRate)) :
-                    # refresh values of already detected registers
-                    for sCircuit in self.dUnits3D:
-                        for sMessage in self.dUnits3D[sCircuit]:
-                            # only refresh first found field, read operation will read all declared fields anyway
-                            dUnit = next(iter(self.dUnits3D[sCircuit][sMessage].values()), None)
-                            if dUnit:
-                                self.read(dUnit)
-                    # check for timeouts
+                for oRecord in lUnitsToRefresh:
+                    self.read(oRecord)
+            # time out units not refreshed in time
+            self.checkTimeouts(timeNow)
+            # detect stalled telnet connections and commands, and reconnect when backoff delay is over
+            for oChannel in self.lChannels:
+                self.checkChannel(oChannel, timeNow)
+            # periodic checks
+            if (timeNow >= (self.iRefreshTime + self.iParamRefreshRate)) :
+                # reconnect listen connection if lost
+                if self.bParamListen:
+                    self.listen()
+                # check for lost JSON HTTP requests
+                self.handleJsonFifo()
+                for oChannel in self.lChannels:
+                    self.myDebug("Queue counters for telnet connection " + str(oChannel.iIndex) + ": " + oChannel.dqFifo.getCounters())
+                # once discovering time is over, time out devices that haven't been detected
+                if (not self.bUndetectedChecked) and (timeNow >= (self.iDiscoverStartTime + self.iDiscoverTime)):
                     for sDeviceID, oDevice in Devices.items():
-                        if not oDevice.TimedOut:
-                            if sDeviceID in self.dUnitsByDeviceID:
-                                dUnit = self.dUnitsByDeviceID[sDeviceID]
-                                if (dUnit["fieldsvaluestimestamp"] + (3 * self.iParamRefreshRate)) < timeNow:
-                                    Domoticz.Error("DeviceID " + oDevice.DeviceID + " not refreshed since a long time and timed out")
-                                    oDevice.TimedOut=1
-                            else:
-                                if timeNow >= (self.iDiscoverStartTime + self.iDiscoverTime):
-                                    Domoticz.Error("DeviceID " + oDevice.DeviceID + " not detected and timed out")
-                                    oDevice.TimedOut=1
-                    # we still not have detected all registers given in configuration, retry JSON search
-                    if self.bStillToLook or (timeNow >= (self.iRefreshFindDeviceTime + self.iRefreshFindDeviceRate)) :
-                        self.findDevices()
-                        self.iRefreshFindDeviceTime = timeNow
-                    self.iRefreshTime = timeNow
+                        if (not oDevice.TimedOut) and (not sDeviceID in self.dUnitsByDeviceID):
+                            Domoticz.Error("DeviceID " + oDevice.DeviceID + " not detected and timed out")
+                            oDevice.TimedOut=1
+                    self.bUndetectedChecked = True
+                # we still not have detected all registers given in configuration, retry JSON search
+                if self.bStillToLook or (timeNow >= (self.iRefreshFindDeviceTime + self.iRefreshFindDeviceRate)) :
+                    self.findDevices()
+                    self.iRefreshFindDeviceTime = timeNow
+                # save values regularly, in case plugin is not stopped properly
+                if timeNow >= (self.iSnapshotTime + self.iSnapshotRate):
+                    self.saveSnapshot()
+                self.iRefreshTime = timeNow
 
 global _plugin
 _plugin = BasePlugin()
@@ -1026,6 +2345,7 @@ def onCommand(DeviceID, Unit, Command, Level, Hue):
 
 def onDeviceAdded(DeviceID, Unit):
     global _plugin
+    _plugin.onDeviceAdded(DeviceID, Unit)
 
 def onDeviceModified(DeviceID, Unit):
     global _plugin
@@ -1033,6 +2353,7 @@ def onDeviceModified(DeviceID, Unit):
 
 def onDeviceRemoved(DeviceID, Unit):
     global _plugin
+    _plugin.onDeviceRemoved(DeviceID, Unit)
 
 def onNotification(Name, Subject, Text, Status, Priority, Sound, ImageFile):
     global _plugin
@@ -1064,6 +2385,203 @@ def DumpConfigToLog():
             Domoticz.Debug("Device LastLevel: " + str(Devices[x].Units[y].LastLevel))
     return
 
+# lower key and remove substrings between [], each distinct key being normalized once
+#   sKey: string: key of a JSON object
+#   dNormalizedKeys: dictionnary: normalized keys keyed by original key, shared by all objects of a JSON document
+def normalizeJsonKey(sKey, dNormalizedKeys):
+    sNormalizedKey = dNormalizedKeys.get(sKey)
+    if sNormalizedKey is None:
+        sNormalizedKey = re.sub(r'\[.+?\]', '', sKey).casefold()
+        dNormalizedKeys[sKey] = sNormalizedKey
+    return sNormalizedKey
+
+# object_pairs_hook for json.loads, build a plain dict with keys lowered and substrings between [] removed
+#   lPairs: list of tuples (key, value) of the JSON object
+#   dNormalizedKeys: dictionnary: normalized keys keyed by original key, shared by all objects of a JSON document
+def normalizeJsonObject(lPairs, dNormalizedKeys):
+    dObject = {}
+    for sKey, value in lPairs:
+        dObject[normalizeJsonKey(sKey, dNormalizedKeys)] = value
+    return dObject
+
+# regular expressions used to walk through JSON objects without decoding them
+reJsonObjectStart = re.compile(r'[ \t\n\r]*\{[ \t\n\r]*')
+reJsonKey = re.compile(r'("(?:[^"\\]|\\.)*")[ \t\n\r]*:[ \t\n\r]*', re.DOTALL)
+reJsonSeparator = re.compile(r'[ \t\n\r]*([,}])[ \t\n\r]*')
+# keys of ebusd messages and fields definitions used by the plugin, others are dropped while parsing
+tEbusdMessageKeys = ("name", "write", "id", "fielddefs")
+tEbusdFieldKeys = ("name", "type", "unit", "comment", "values")
+
+# Extract complete frames from a receive buffer, consumed bytes are removed from the buffer and the incomplete last frame is kept
+#   baBuffer: bytearray: received data
+#   iScanPos: integer: position from which the separator is searched, data before has already been scanned
+#   bytesSeparator: bytes: end of frame
+#   return: list of strings: decoded frames, integer: position from which the separator is searched next time
+def splitFrames(baBuffer, iScanPos, bytesSeparator):
+    lFrames = []
+    iStart = 0
+    # frames are decoded from the buffer without intermediate copies
+    with memoryview(baBuffer) as mvBuffer:
+        iEnd = baBuffer.find(bytesSeparator, iScanPos)
+        while iEnd >= 0:
+            lFrames.append(str(mvBuffer[iStart:iEnd], "utf-8", "ignore"))
+            iStart = iEnd + len(bytesSeparator)
+            iEnd = baBuffer.find(bytesSeparator, iStart)
+    del baBuffer[:iStart]
+    # a separator may be split between this data and next data
+    return lFrames, max(0, len(baBuffer) - len(bytesSeparator) + 1)
+
+# walk through a JSON object, calling fnValue for each member without decoding the whole object
+#   sData: string: JSON document
+#   iPos: integer: position of the object in sData
+#   fnValue: function: called with the key and the position of its value, returns the position after the value
+#   return: integer: position after the object
+def walkJsonObject(sData, iPos, fnValue):
+    oMatch = reJsonObjectStart.match(sData, iPos)
+    if oMatch is None:
+        raise ValueError("JSON object expected at position " + str(iPos))
+    iPos = oMatch.end()
+    if sData.startswith("}", iPos):
+        return iPos + 1
+    while True:
+        oMatch = reJsonKey.match(sData, iPos)
+        if oMatch is None:
+            raise ValueError("JSON key expected at position " + str(iPos))
+        iPos = fnValue(json.loads(oMatch.group(1)), oMatch.end())
+        oMatch = reJsonSeparator.match(sData, iPos)
+        if oMatch is None:
+            raise ValueError("JSON separator expected at position " + str(iPos))
+        iPos = oMatch.end()
+        if oMatch.group(1) == "}":
+            return iPos
+
+# count messages of each circuit in ebusd JSON data (/data), without keeping messages
+#   sData: string: JSON data received from ebusd
+#   return: tuple: dictionnary "global" with normalized keys, and dictionnary of tuples (circuit name as received, messages count) keyed by normalized circuit name
+def countEbusdMessages(sData):
+    dNormalizedKeys = {}
+    oDecoder = json.JSONDecoder(object_pairs_hook= lambda lPairs: normalizeJsonObject(lPairs, dNormalizedKeys))
+    dGlobal = {}
+    dCircuits = {}
+
+    def countCircuit(sKey, iPos):
+        sCircuit = normalizeJsonKey(sKey, dNormalizedKeys)
+        if (sCircuit == "global") or (sData[iPos] != "{"):
+            value, iPos = oDecoder.raw_decode(sData, iPos)
+            if sCircuit == "global":
+                dGlobal.update(value)
+            return iPos
+        lCount = [0]
+
+        def countMessage(sKey, iPos):
+            lCount[0] += 1
+            return oDecoder.raw_decode(sData, iPos)[1]
+
+        def countCircuitMember(sKey, iPos):
+            if (normalizeJsonKey(sKey, dNormalizedKeys) == "messages") and (sData[iPos] == "{"):
+                return walkJsonObject(sData, iPos, countMessage)
+            return oDecoder.raw_decode(sData, iPos)[1]
+
+        iPos = walkJsonObject(sData, iPos, countCircuitMember)
+        dCircuits[sCircuit] = (sKey, lCount[0])
+        return iPos
+
+    walkJsonObject(sData, 0, countCircuit)
+    return dGlobal, dCircuits
+
+# index fields definitions of a message in one pass, ignored fields are not counted
+#   lFieldDefs: list of dictionnaries: fielddefs of the message
+#   return: dictionnary:
+#     "absolute": list of integers: absolute index in fielddefs of each usable field, by relative index
+#     "names": dictionnary of integers keyed by lowered field name, relative index of first usable field with this name
+#     "types": list of strings: field type of each field by absolute index, cf. getFieldType() return value
+def indexFieldDefs(lFieldDefs):
+    lAbsoluteIndexes = []
+    dNames = {}
+    lTypes = []
+    for iAbsoluteIndex, dFieldDefs in enumerate(lFieldDefs):
+        sFieldType = getFieldType(dFieldDefs)
+        lTypes.append(sFieldType)
+        if sFieldType != "ignore":
+            if dFieldDefs.get("name"):
+                dNames.setdefault(dFieldDefs["name"].casefold(), len(lAbsoluteIndexes))
+            lAbsoluteIndexes.append(iAbsoluteIndex)
+    return {"absolute": lAbsoluteIndexes, "names": dNames, "types": lTypes}
+
+# give signature of definition of a message and of its writable message, to find units restored from schema cache whose definition changed
+#   dMessages: dictionnary: compact messages of a circuit, cf. parseEbusdSchema()
+#   sMessage: string: name of the read message
+#   return: string: signature, empty if message doesn't exist
+def getMessageSignature(dMessages, sMessage):
+    lDefinitions = [[dMessageItem.get("write", False), str(dMessageItem.get("id", "")), dMessageItem.get("fielddefs")] for dMessageItem in (dMessages.get(sMessage), dMessages.get(sMessage + "-w")) if dMessageItem]
+    if not lDefinitions:
+        return ""
+    return hashlib.sha1(json.dumps(lDefinitions, sort_keys=True).encode("utf-8")).hexdigest()
+
+# incremental parse of ebusd JSON definitions (/data?def&write), one message at a time
+# scan circuits are skipped and only the definitions used by the plugin are kept, so memory doesn't grow with the size of the full JSON tree
+#   sData: string: JSON data received from ebusd
+#   return: dictionnary: same structure as JSON data with normalized keys, "global" then circuits with compact "messages" only, each message with its "fieldsindex" (see indexFieldDefs)
+def parseEbusdSchema(sData):
+    dNormalizedKeys = {}
+    # repeated strings (types, units...) are shared
+    dStrings = {}
+    oDecoder = json.JSONDecoder(object_pairs_hook= lambda lPairs: normalizeJsonObject(lPairs, dNormalizedKeys))
+    dSchema = {}
+
+    def compactMessage(dMessageItem):
+        dCompact = {sKey: dMessageItem[sKey] for sKey in tEbusdMessageKeys if sKey in dMessageItem}
+        if ("fielddefs" in dCompact) and (type(dCompact["fielddefs"]) is list):
+            lFieldDefs = []
+            for dFieldDefs in dCompact["fielddefs"]:
+                dCompactField = {}
+                for sKey in tEbusdFieldKeys:
+                    if sKey in dFieldDefs:
+                        value = dFieldDefs[sKey]
+                        if type(value) is str:
+                            value = dStrings.setdefault(value, value)
+                        dCompactField[sKey] = value
+                lFieldDefs.append(dCompactField)
+            dCompact["fielddefs"] = lFieldDefs
+            dCompact["fieldsindex"] = indexFieldDefs(lFieldDefs)
+        return dCompact
+
+    def parseCircuit(sKey, iPos):
+        sCircuit = normalizeJsonKey(sKey, dNormalizedKeys)
+        if (sCircuit == "global") or (sCircuit.startswith("scan.")) or (sData[iPos] != "{"):
+            value, iPos = oDecoder.raw_decode(sData, iPos)
+            if sCircuit == "global":
+                dSchema[sCircuit] = value
+            return iPos
+        dMessages = {}
+        dSchema[sCircuit] = {"messages": dMessages}
+
+        def parseMessage(sKey, iPos):
+            dMessageItem, iPos = oDecoder.raw_decode(sData, iPos)
+            if type(dMessageItem) is dict:
+                dMessages[normalizeJsonKey(sKey, dNormalizedKeys)] = compactMessage(dMessageItem)
+            return iPos
+
+        def parseCircuitMember(sKey, iPos):
+            if (normalizeJsonKey(sKey, dNormalizedKeys) == "messages") and (sData[iPos] == "{"):
+                return walkJsonObject(sData, iPos, parseMessage)
+            return oDecoder.raw_decode(sData, iPos)[1]
+
+        iPos = walkJsonObject(sData, iPos, parseCircuitMember)
+        # writable message definition usually repeats the read one, share it
+        for sMessage, dMessageItem in dMessages.items():
+            if sMessage.endswith("-w") and (sMessage[:-2] in dMessages):
+                dReadMessageItem = dMessages[sMessage[:-2]]
+                if ("fielddefs" in dMessageItem) and (dMessageItem["fielddefs"] == dReadMessageItem.get("fielddefs")):
+                    dMessageItem["fielddefs"] = dReadMessageItem["fielddefs"]
+                    dMessageItem["fieldsindex"] = dReadMessageItem["fieldsindex"]
+        return iPos
+
+    iPos = walkJsonObject(sData, 0, parseCircuit)
+    if sData[iPos:].strip():
+        raise ValueError("Extra data at position " + str(iPos))
+    return dSchema
+
 # give a type name based of unit, name, type and values for dFieldDefs (dict) of ebusd fielddefs
 def getFieldType(dFieldDefs):
     sFieldUnit = dFieldDefs["unit"]
@@ -1163,93 +2681,91 @@ def getFieldType(dFieldDefs):
         "TEM_P": "number"
         }.get(sFieldType, "text")
 
-# convert domoticz sCommand (string) and ifValue (integer of float) or sValue (string) to string value for ebusd, for dUnit (dictionnary)
-def valueDomoticzToEbusd(dUnit, sCommand, ifValue, sValue, previousIValue, previousSValue):
-    sLowerCommand = sCommand.casefold()
-    dReverseOptionsMapping = dUnit["reverseoptions"]
-    if len(dReverseOptionsMapping) > 0:
-        if ifValue in dReverseOptionsMapping:
-            return dReverseOptionsMapping[ifValue]
-        else:
-            return str(ifValue)
-    elif (sLowerCommand == "on") or (sLowerCommand == "yes"):
-        if dUnit["fieldtype"] == "switchyesno":
-            return "yes"
-        else:
-            return "on"
-    elif (sLowerCommand == "off") or (sLowerCommand == "no"):
-        if dUnit["fieldtype"] == "switchyesno":
-            return "no"
-        else:
-            return "off"
-    elif sLowerCommand == "toggle":
-        if previousIValue:
-            if dUnit["fieldtype"] == "switchyesno":
-                return "no"
-            else:
-                return "off"
-        else:
-            if dUnit["fieldtype"] == "switchyesno":
-                return "yes"
-            else:
-                return "on"
+# ebusd values of switches, lowered, and corresponding domoticz integer and string values
+dSwitchValues = {"on": (1, "100"), "yes": (1, "100"), "off": (0, "0"), "no": (0, "0")}
+# ebusd value that converts to an integer, surrounding whitespaces excluded
+reIntegerValue = re.compile(r'[+-]?[0-9]+(?:_[0-9]+)*')
+
+# convert ebus sFieldValue (string) to integer for domoticz, 0 if not an integer
+#   oRecord: UnitRecord: unit, for logs
+def integerEbusdToDomoticz(oRecord, sFieldValue):
+    sStrippedValue = sFieldValue.strip()
+    if sStrippedValue.isdecimal() or reIntegerValue.fullmatch(sStrippedValue):
+        iValue = int(sStrippedValue)
+    # int() needs at least a digit, other values are left to it to accept the same values
+    elif not any(sChar.isdecimal() for sChar in sStrippedValue):
+        return 0
     else:
-        if dUnit["fieldtype"] == "switchonoff":
-            if ifValue == 0:
-                return "off"
-            else:
-                return "on"
-        elif dUnit["fieldtype"] == "switchyesno":
-            if ifValue == 0:
-                return "no"
-            else:
-                return "yes"
-        elif sValue:
-            return sValue
-        else:
-            return str(ifValue)
-            
-    return ""
+        try:
+            iValue = int(sStrippedValue)
+        except ValueError:
+            return 0
+    # prevent overflow when translating to C language
+    if iValue >= 2147483647:
+        Domoticz.Debug("Integer value too big, converted to 0, for circuit " + oRecord.sCircuit + " message " + oRecord.sMessage + " field " + str(oRecord.iFieldIndex))
+        iValue = 0
+    return iValue
 
-# convert ebus sFieldValue (string) to integer, string values for domoticz, for dUnit (dictionnary)
-def valueEbusdToDomoticz(dUnit, sFieldValue):
-    dOptionsMapping = dUnit["options"]
+# choose once the converter of ebusd field values to domoticz values of a unit, depending on its options and field type
+#   oRecord: UnitRecord: unit
+#   return: function: converts ebus sFieldValue (string) to tuple of integer, string values for domoticz
+def compileEbusdToDomoticz(oRecord):
+    dOptionsMapping = oRecord.dOptions
     if len(dOptionsMapping) > 0:
-        if sFieldValue in dOptionsMapping:
-            # iValue from GetLightStatus in RFXName.cpp and hardwaretypes.h
-            iValue = 2
-            sValue = str(dOptionsMapping[sFieldValue])
-        else:
-            try:
-                iValue = int(sFieldValue)
-            except ValueError:
-                iValue = 0
-            sValue = sFieldValue
-    else:
-        sLowerFieldValue = sFieldValue.casefold()
-        if (sLowerFieldValue == "on") or (sLowerFieldValue == "yes"):
-            iValue = 1
-            sValue = "100"
-        elif (sLowerFieldValue == "off") or (sLowerFieldValue == "no"):
-            iValue = 0
-            sValue = "0"
-        else:
+        def convertOption(sFieldValue):
+            if sFieldValue in dOptionsMapping:
+                # iValue from GetLightStatus in RFXName.cpp and hardwaretypes.h
+                return 2, str(dOptionsMapping[sFieldValue])
+            return integerEbusdToDomoticz(oRecord, sFieldValue), sFieldValue
+        return convertOption
+    elif oRecord.sFieldType == "temperature":
+        def convertTemperature(sFieldValue):
+            # switch values begin with a letter
+            if sFieldValue[:1].isalpha() and (sFieldValue.casefold() in dSwitchValues):
+                return dSwitchValues[sFieldValue.casefold()]
+            # round temperature by 1 digit
             try:
-                iValue = int(sFieldValue)
+                sValue = str(round(float(sFieldValue),1))
             except ValueError:
-                iValue = 0
-            # round temperature by 1 digit
-            if dUnit["fieldtype"] == "temperature":
-                try:
-                    sValue = str(round(float(sFieldValue),1))
-                except ValueError:
-                    sValue = sFieldValue
-            else:
                 sValue = sFieldValue
-
-    # prevent overflow when translating to C language
-    if iValue >= 2147483647:
-        Domoticz.Debug("Integer value too big, converted to 0, for circuit " + dUnit["circuit"] + " message " + dUnit["message"] + " field " + str(dUnit["fieldindex"]))
-        iValue = 0
-   
-    return iValue, sValue
+            return integerEbusdToDomoticz(oRecord, sFieldValue), sValue
+        return convertTemperature
+    else:
+        def convertValue(sFieldValue):
+            # switch values begin with a letter
+            if sFieldValue[:1].isalpha() and (sFieldValue.casefold() in dSwitchValues):
+                return dSwitchValues[sFieldValue.casefold()]
+            return integerEbusdToDomoticz(oRecord, sFieldValue), sFieldValue
+        return convertValue
+
+# choose once the converter of domoticz commands to ebusd values of a unit, depending on its options and field type
+#   oRecord: UnitRecord: unit
+#   return: function: converts domoticz sCommand (string) and ifValue (integer of float) or sValue (string) and previousIValue (integer) to string value for ebusd
+def compileDomoticzToEbusd(oRecord):
+    dReverseOptionsMapping = oRecord.dReverseOptions
+    if len(dReverseOptionsMapping) > 0:
+        def convertOption(sCommand, ifValue, sValue, previousIValue):
+            if ifValue in dReverseOptionsMapping:
+                return dReverseOptionsMapping[ifValue]
+            return str(ifValue)
+        return convertOption
+    if oRecord.sFieldType == "switchyesno":
+        sOn, sOff = "yes", "no"
+    else:
+        sOn, sOff = "on", "off"
+    bSwitch = oRecord.sFieldType in ("switchonoff", "switchyesno")
+
+    def convertCommand(sCommand, ifValue, sValue, previousIValue):
+        sLowerCommand = sCommand.casefold()
+        if (sLowerCommand == "on") or (sLowerCommand == "yes"):
+            return sOn
+        elif (sLowerCommand == "off") or (sLowerCommand == "no"):
+            return sOff
+        elif sLowerCommand == "toggle":
+            return sOff if previousIValue else sOn
+        elif bSwitch:
+            return sOff if ifValue == 0 else sOn
+        elif sValue:
+            return sValue
+        return str(ifValue)
+    return convertCommand